@@ -29,6 +29,45 @@ fi
 #[ -z "${CYM_STATS}" ] && { echo "No operation is set. Exiting"; exit 1; }
 [ -z "${CYM_CHANNELS}" ] || exit 1
 
+# batch mode: a single import_data.py process for all simulations
+if [ -n "$CYM_STATS" -a -n "$CYM_BATCH" ]; then
+  # the time courses which pass the checks of the loop below
+  BATCH_LOG=$(mktemp)
+  for f in $@; do
+    F=$(realpath "$f")
+    if [ ! -f "${F}" ]; then
+      echo "'${F}' is not a valid log file name."
+      continue
+    fi
+    for d in $(cat "$F"); do
+      tmp=${d%/*};
+      CASE_ID=${tmp##*/}
+      if [ ! -d "${d}" ]; then
+        echo "$d is not a valid directory path."
+      elif [ ! -f "${d}/objects.cmo" ]; then
+        echo "objects.cmo is missing in $d. Skipping this time course..."
+      elif [ ! -f "${d}/properties.cmo" ]; then
+        echo "properties.cmo is missing in $d. Skipping this time course..."
+      elif [ ! -f "${d}/${CASE_ID}.cym" ]; then
+        echo "Warning: Cytosim model file (${CASE_ID}.cym) not found in $d. Skipping this time course..."
+      else
+        echo "$d" >>"$BATCH_LOG"
+      fi
+    done
+  done
+  STATUS=0
+  if [ -s "$BATCH_LOG" ]; then
+    $SHELL -c "${HOME}/pyCytosim/import_data.py --logs $BATCH_LOG --op ${CYM_STATS} --frame-step ${FRAME_STEP} --jobs ${CYM_BATCH} >${BATCH_LOG}.out"
+    STATUS=$?
+    # the log of the batch covers all time courses, every one gets a copy
+    for d in $(cat "$BATCH_LOG"); do
+      cp "${BATCH_LOG}.out" "$d/stats.log"
+    done
+  fi
+  rm -f "$BATCH_LOG" "${BATCH_LOG}.out"
+  exit $STATUS
+fi
+
 # loop over input arguments (log files)
 for f in $@; do
   F=$(realpath "$f")
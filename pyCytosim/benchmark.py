@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import sys
+import time
+import shutil
+import tempfile
+import pickle
+import tracemalloc
+import contextlib
+
+import numpy as np
+
+import click
+
+import cmoreader
+import cytosim
+import framestore
+
+###
+# Synthetic data
+###
+
+def synthetic_report(op, num_frames, num_fibers, seed=0):
+  """
+  Generate the stdout of 'report' for a given operation
+    op         : operation (one of cytosim.opts_dict keys)
+    num_frames : number of frames
+    num_fibers : number of fibers per frame
+  """
+  rng = np.random.default_rng(seed)
+  out = io.StringIO()
+  out.write(f'% {cytosim.opts_dict[op]}\n')
+  for frm in range(num_frames):
+    out.write(f'% frame {frm}\n')
+    out.write(f'% time {frm*10.0:.3f}\n')
+    if(op == cytosim.CS_FIBER_POS):
+      out.write('% class identity length posX posY dirX dirY endToEnd cosinus organizer\n')
+      vals = rng.uniform(-10, 10, size=(num_fibers, 7))
+      for i in range(num_fibers):
+        v = vals[i]
+        out.write(f'{1:5d} {i+1:7d} {abs(v[0]):9.4f} {v[1]:9.4f} {v[2]:9.4f} {v[3]/10:9.4f} {v[4]/10:9.4f} {abs(v[5]):9.4f} {v[6]/10:9.4f} {0:5d}\n')
+    elif(op == cytosim.CS_FIBER_END):
+      out.write('% class identity length stateM posX posY dirX dirY stateP posX posY dirX dirY\n')
+      vals = rng.uniform(-10, 10, size=(num_fibers, 9))
+      for i in range(num_fibers):
+        v = vals[i]
+        out.write(f'{1:5d} {i+1:7d} {abs(v[0]):9.4f} {0:3d} ' + ' '.join(f'{x:9.4f}' for x in v[1:5]) + f' {1:3d} ' + ' '.join(f'{x:9.4f}' for x in v[5:9]) + '\n')
+    elif(op == cytosim.CS_FIBER_CLUS):
+      out.write('% id nb_fibers : fiber identities\n')
+      members = rng.permutation(num_fibers) + 1
+      bounds = np.unique(rng.integers(0, num_fibers, size=max(1, num_fibers//20)))
+      for i, fibers in enumerate(np.split(members, bounds)):
+        if(len(fibers)):
+          out.write(f'{i+1:5d} {len(fibers):5d} : ' + ' '.join(map(str, fibers)) + '\n')
+    elif(op == cytosim.CS_FIBER_LEN):
+      out.write('% class count avg dev min max total\n')
+      v = rng.uniform(1, 10, size=5)
+      out.write(f'microtubule {num_fibers:7d} {v[0]:9.4f} {v[1]:9.4f} {v[2]:9.4f} {v[3]:9.4f} {v[0]*num_fibers:9.4f}\n')
+    elif(op == cytosim.CS_SINGLE_FORCE):
+      # num_fibers singles, attached to 1 of 100 fibers
+      out.write('% class identity fiber posX posY forceX forceY\n')
+      ids = np.arange(1, num_fibers+1)
+      vals = np.column_stack([ np.ones(num_fibers), ids, rng.integers(1, 101, size=num_fibers),
+                               rng.uniform(-10, 10, size=(num_fibers, 2)), rng.normal(0, 2, size=(num_fibers, 2)) ])
+      np.savetxt(out, vals, fmt=['%5d', '%7d', '%7d', '%9.4f', '%9.4f', '%9.4f', '%9.4f'])
+    else:
+      raise RuntimeError(f'no synthetic data for operation "{op}"')
+    out.write('% end\n')
+  return out.getvalue().encode('ascii')
+
+# stand-in for the 'report' executable: every frame costs a fixed amount of
+# CPU time (reading the trajectory) before its fiber:position lines are written
+STANDIN_REPORT = """#!{python}
+import sys, time
+cost, fibers = {cost}, {fibers}
+frames = range({frames})
+for arg in sys.argv[2:]:
+  if arg.startswith('frame='):
+    frames = list(map(int, arg[6:].split(',')))
+print('% ' + sys.argv[1])
+for frm in frames:
+  time_stop = time.process_time() + cost
+  while time.process_time() < time_stop:
+    pass
+  print('% frame ' + str(frm))
+  for i in range(fibers):
+    print('%5d %7d %9.4f %9.4f %9.4f %9.4f %9.4f %9.4f %9.4f %5d' % (1, i+1, 1.0, frm, i, 1.0, 0.0, 1.0, 1.0, 0))
+  print('% end')
+"""
+
+def standin_report(bindir, frames, fibers, cost):
+  """
+  Write a stand-in 'report' executable into bindir
+  """
+  cmd = os.path.join(bindir, 'report')
+  with open(cmd, 'w') as handle:
+    handle.write(STANDIN_REPORT.format(python=sys.executable, cost=cost, fibers=fibers, frames=frames))
+  os.chmod(cmd, 0o755)
+  return cmd
+
+def synthetic_play_images(tdir, frames, size, fibers, seed=0):
+  """
+  Write white fibers on a black background the way 'play' renders a channel
+    tdir   : output directory
+    frames : number of frames
+    size   : image width and height in pixels
+    fibers : number of straight fibers per frame
+  """
+  import matplotlib.image
+  rng = np.random.default_rng(seed)
+  t = np.linspace(0, 1, size // 8)
+  for frm in range(frames):
+    im = np.zeros((size, size, 3), dtype=np.uint8)
+    start = rng.uniform(0, size, size=(fibers, 2))
+    end = np.clip(start + rng.normal(0, size / 20, size=(fibers, 2)), 0, size - 1)
+    pts = (start[:, None, :] + t[None, :, None] * (end - start)[:, None, :]).reshape(-1, 2).astype(int)
+    im[pts[:, 1], pts[:, 0], :] = 255
+    matplotlib.image.imsave(os.path.join(tdir, f'image{frm:04d}.png'), im)
+
+# stand-in for the 'play' executable: every frame costs a fixed amount of
+# CPU time (reading and rendering the trajectory) before its image is written,
+# every visible entity is drawn in its color at fixed random positions
+STANDIN_PLAY = """#!{python}
+import os, re, sys, time, zlib
+import numpy as np
+import matplotlib.image
+cost, size = {cost}, {size}
+frames, tdir = [], '.'
+for arg in sys.argv[2:]:
+  if arg.startswith('frame='):
+    frames = list(map(int, arg[6:].split(',')))
+  if arg.startswith('image_dir='):
+    tdir = arg[10:]
+colors = []
+for name, color in re.findall(r'set \\w+ (\\w+)[^}}]*?color=(\\w+); visible=1', open('properties.cmo').read()):
+  if color.startswith('0x'):
+    colors.append((name, [ int(color[i:i+2], 16) for i in (2, 4, 6) ]))
+  elif color == 'white':
+    colors.append((name, [255, 255, 255]))
+for frm in frames:
+  time_stop = time.process_time() + cost
+  while time.process_time() < time_stop:
+    pass
+  im = np.zeros((size, size, 3), dtype=np.uint8)
+  for name, color in colors:
+    rng = np.random.default_rng([frm, zlib.crc32(name.encode())])
+    im[rng.integers(0, size, 2000), rng.integers(0, size, 2000)] = color
+  matplotlib.image.imsave(os.path.join(tdir, 'image%04d.png' % frm), im)
+"""
+
+def standin_play(bindir, size, cost):
+  """
+  Write a stand-in 'play' executable into bindir
+  """
+  cmd = os.path.join(bindir, 'play')
+  with open(cmd, 'w') as handle:
+    handle.write(STANDIN_PLAY.format(python=sys.executable, cost=cost, size=size))
+  os.chmod(cmd, 0o755)
+  return cmd
+
+def synthetic_cmo(simdir, num_frames, num_fibers, classes=('microtubule',), seed=0):
+  """
+  Write a text objects.cmo with random straight fibers, and its properties.cmo
+    simdir     : simulation directory
+    num_frames : number of frames
+    num_fibers : number of fibers per class and frame
+    classes    : fiber class names
+  """
+  rng = np.random.default_rng(seed)
+  with open(os.path.join(simdir, 'properties.cmo'), 'w') as handle:
+    for name in classes:
+      handle.write(f'set fiber {name}\n{{\n display = (color=white;)\n}}\n')
+  with open(os.path.join(simdir, 'objects.cmo'), 'w') as handle:
+    for frm in range(num_frames):
+      handle.write(f'#Cytosim  1 {frm}\n#time {frm*10.0:.3f}\n#section fiber\n')
+      for icls in range(len(classes)):
+        start = rng.uniform(-10, 10, size=(num_fibers, 2))
+        angle = rng.uniform(0, 2*np.pi, size=num_fibers)
+        for i in range(num_fibers):
+          # 10 vertices, 0.5 um apart
+          pts = start[i] + np.outer(0.5*np.arange(10), [np.cos(angle[i]), np.sin(angle[i])])
+          handle.write(f'f{icls+1}:{i+1} 0 0.5 0.0 10 ' + ' '.join(f'{x:.4f}' for x in pts.ravel()) + '\n')
+      handle.write('#section end\n')
+
+def feed_protocol(protocol, data, chunk_size):
+  """
+  Push data into a protocol the way an asyncio pipe transport would
+  """
+  for pos in range(0, len(data), chunk_size):
+    protocol.pipe_data_received(1, data[pos:pos+chunk_size])
+
+def read_saved_report(op, filepath):
+  """
+  FrameTable of a saved 'report' output (e.g. report fiber:position > position.txt)
+  """
+  protocol = cytosim.CytosimReportProtocol(None, op, None, None, verbose=0)
+  with open(filepath, 'rb') as handle:
+    feed_protocol(protocol, handle.read(), 65536)
+  # the last frame may not be terminated
+  if(protocol._frm_idx is not None):
+    protocol._end_frame()
+  return protocol._data.build()
+
+###
+# Benchmarks
+###
+
+@click.group()
+def main():
+  pass
+
+@main.command('report-parser')
+@click.option("--op", default='pos,end', help="A comma-separated list of operations to benchmark: " + ", ".join(cytosim.opts_dict.keys()))
+@click.option("--frames", default=20, help="Number of frames.")
+@click.option("--fibers", default=20000, help="Number of fibers per frame.")
+@click.option("--chunk", default=65536, help="Pipe chunk size in bytes.")
+def report_parser(op : str, frames : int, fibers : int, chunk : int):
+  """Compare the line-by-line and the vectorized report parsers."""
+  for o in op.split(','):
+    o = o.strip()
+    data = synthetic_report(o, frames, fibers)
+    click.echo(f'{cytosim.opts_dict[o]}: {len(data)/2**20:.1f} MB, {frames} frame(s) x {fibers} fiber(s)')
+
+    timings = dict()
+    results = dict()
+    for vectorized in [False, True]:
+      protocol = cytosim.CytosimReportProtocol(None, o, None, None, vectorized=vectorized)
+      with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        time_start = time.perf_counter()
+        feed_protocol(protocol, data, chunk)
+        timings[vectorized] = time.perf_counter() - time_start
+      results[vectorized] = protocol._data.build()
+
+    same = results[False] == results[True]
+    click.echo(f'  line-by-line: {timings[False]:8.3f} s ({len(data)/2**20/timings[False]:8.1f} MB/s)')
+    click.echo(f'  vectorized  : {timings[True]:8.3f} s ({len(data)/2**20/timings[True]:8.1f} MB/s)')
+    click.echo(f'  speedup     : {timings[False]/timings[True]:8.2f}x, identical results: {same}')
+
+class FramingOnlyProtocol(cytosim.CytosimReportProtocol):
+  """Report protocol that drops the frame blocks, to time the line framing alone"""
+  def _end_frame(self):
+    self._block = None
+
+@main.command('pipe-framing')
+@click.option("--op", default='pos', help="Operation to benchmark: " + ", ".join(cytosim.opts_dict.keys()))
+@click.option("--frames", default=20, help="Number of frames.")
+@click.option("--fibers", default=20000, help="Number of fibers per frame.")
+@click.option("--chunks", default=','.join(map(str, [65536, 1048576])), help="A comma-separated list of pipe chunk sizes in bytes.")
+@click.option("--repeat", default=3, help="Number of repetitions, the best time is reported.")
+def pipe_framing(op : str, frames : int, fibers : int, chunks : str, repeat : int):
+  """Throughput of the pipe_data_received line framing at several chunk sizes."""
+  data = synthetic_report(op, frames, fibers)
+  click.echo(f'{cytosim.opts_dict[op]}: {len(data)/2**20:.1f} MB, {frames} frame(s) x {fibers} fiber(s)')
+  reference = None
+  for chunk in [ int(c) for c in chunks.split(',') ]:
+    timings = dict()
+    for name, factory in [('framing', FramingOnlyProtocol), ('framing+parsing', cytosim.CytosimReportProtocol)]:
+      best = None
+      for _ in range(repeat):
+        protocol = factory(None, op, None, None, verbose=0)
+        time_start = time.perf_counter()
+        feed_protocol(protocol, data, chunk)
+        elapsed = time.perf_counter() - time_start
+        best = elapsed if best is None else min(best, elapsed)
+      timings[name] = best
+    table = protocol._data.build()
+    if(reference is None):
+      reference = table
+    click.echo(f'  {chunk:>8d} B chunks: ' + ', '.join(f'{name} {len(data)/2**20/t:8.1f} MB/s' for name, t in timings.items()) +
+               f', identical results: {table == reference}')
+
+@main.command('frame-store')
+@click.option("--frames", default=10000, help="Number of frames.")
+@click.option("--fibers", default=200, help="Number of fibers per frame.")
+def frame_store(frames : int, fibers : int):
+  """Compare the nested dict and the columnar fiber:position results."""
+  rng = np.random.default_rng(0)
+  builder = framestore.FrameTableBuilder(cytosim.opts_dict[cytosim.CS_FIBER_POS])
+  for frm in range(frames):
+    builder.append(frm, { 'identity' : np.arange(1, fibers+1, dtype=np.int64),
+                          'posC' : rng.uniform(-10, 10, size=(fibers, 2)),
+                          'dirC' : rng.uniform(-1, 1, size=(fibers, 2)),
+                          'cosC' : rng.uniform(-1, 1, size=fibers) })
+  table = builder.build()
+  tracemalloc.start()
+  nested = { frm : dict(zip(cols['identity'].tolist(), map(list, zip(cols['posC'].tolist(), cols['dirC'].tolist(), cols['cosC'].tolist()))))
+             for frm, cols in table.items() }
+  nested_nbytes, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  click.echo(f'fiber:position: {frames} frame(s) x {fibers} fiber(s)')
+  for name, data in [('nested dict', nested), ('columnar', table.state())]:
+    time_start = time.perf_counter()
+    raw = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    time_dump = time.perf_counter() - time_start
+    time_start = time.perf_counter()
+    pickle.loads(raw)
+    time_load = time.perf_counter() - time_start
+    click.echo(f'  {name:12s}: {len(raw)/2**20:8.1f} MB pickled, dump {time_dump:7.3f} s, load {time_load:7.3f} s')
+  click.echo(f'  in memory: nested dict {nested_nbytes/2**20:.1f} MB, columnar {table.nbytes/2**20:.1f} MB')
+
+@main.command('report-shards')
+@click.option("--frames", default=64, help="Number of frames.")
+@click.option("--fibers", default=200, help="Number of fibers per frame.")
+@click.option("--cost", default=0.05, help="CPU time in seconds the stand-in report spends on every frame.")
+@click.option("--shards", default=','.join(map(str, [1, 2, 4, 8])), help="A comma-separated list of shard counts.")
+def report_shards(frames : int, fibers : int, cost : float, shards : str):
+  """Speedup of frame-range sharding with a stand-in report executable."""
+  with tempfile.TemporaryDirectory() as bindir, tempfile.TemporaryDirectory() as simdir:
+    standin_report(bindir, frames, fibers, cost)
+    os.environ['CYTOSIMBINPATH'] = bindir
+
+    click.echo(f'fiber:position: {frames} frame(s) x {fibers} fiber(s), {cost} s per frame, {os.cpu_count()} core(s)')
+    reference = None
+    time_single = None
+    for n in map(int, shards.split(',')):
+      args = { 'kind' : 'report', 'simdir' : simdir, 'ops' : [cytosim.CS_FIBER_POS], 'frames' : list(range(frames)), 'out' : f'shards{n}', 'shards' : n }
+      with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        time_start = time.perf_counter()
+        result = cytosim.run_cytosim_async_loop(args)[cytosim.CS_FIBER_POS]
+        elapsed = time.perf_counter() - time_start
+      if(reference is None):
+        reference, time_single = result, elapsed
+      click.echo(f'  {n:3d} shard(s): {elapsed:8.3f} s, speedup {time_single/elapsed:6.2f}x, identical results: {result == reference}')
+
+def compare_tables(reference, table, atol):
+  """
+  Largest absolute difference of every column, after matching the rows by identity
+  """
+  diffs = dict()
+  for frm in reference.keys():
+    if(frm not in table):
+      diffs['frames'] = np.inf
+      continue
+    ref, cur = reference.frame(frm), table.frame(frm)
+    if('identity' in ref):
+      iref, icur = np.argsort(ref['identity']), np.argsort(cur['identity'])
+      if(not np.array_equal(ref['identity'][iref], cur['identity'][icur])):
+        diffs['identity'] = np.inf
+        continue
+    else:
+      iref, icur = slice(None), slice(None)
+    for name, col in ref.items():
+      if(name not in cur)or(col.dtype.kind not in 'fiu'):
+        continue
+      d = np.max(np.abs(col[iref] - cur[name][icur]), initial=0.0)
+      diffs[name] = max(diffs.get(name, 0.0), d)
+  return { name : (d, d <= atol) for name, d in diffs.items() }
+
+@main.command('cmo-reader')
+@click.option("--simdir", required=True, help="The directory with cytosim simulation data.")
+@click.option("--op", default='pos,end,length', help="A comma-separated list of operations to compare.")
+@click.option("--frames", default='all', type=str, help="A comma-separated list of frames. Defaults to 'all'")
+@click.option("--atol", default=1e-3, help="Tolerance for the printed precision of report.")
+@click.option("--saved", default=None, help="Output of 'report' for a single --op saved in a file (e.g. report fiber:position > position.txt), used instead of running report.")
+def cmo_reader(simdir : str, op : str, frames : str, atol : float, saved : str):
+  """
+  Check and time the experimental objects.cmo reader against the report executable.
+
+  Without cytosim at hand, run it against a reference captured once with report
+  in a simulation directory with a text trajectory (binary_output=0), e.g.
+  report fiber:position > position.txt, passed with --saved. Exits with status 1
+  if a column does not match.
+  """
+  if(not cmoreader.is_text(os.path.join(simdir, 'objects.cmo'))):
+    raise click.ClickException(f'{simdir}/objects.cmo is a binary trajectory, the objects.cmo reader decodes only text trajectories')
+  ops = [ o.strip() for o in op.split(',') ]
+  frames_idx = None if frames == 'all' else sorted(set(map(int, frames.split(','))))
+  results = dict()
+  timings = dict()
+  kinds = ['report', 'cmo']
+  if(saved is not None):
+    if(len(ops) != 1):
+      raise click.UsageError('--saved compares a single operation')
+    table = read_saved_report(ops[0], saved)
+    if(frames_idx is not None):
+      table = table.select([ frm for frm in frames_idx if frm in table ])
+    results['report'] = { ops[0] : table }
+    frames_idx = table.keys() if frames_idx is None else frames_idx
+    kinds = ['cmo']
+  with tempfile.TemporaryDirectory() as outdir:
+    for kind in kinds:
+      args = { 'kind' : kind, 'simdir' : simdir, 'ops' : ops, 'frames' : frames_idx, 'out' : os.path.join(outdir, kind) }
+      with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        time_start = time.perf_counter()
+        results[kind] = cytosim.run_cytosim_async_loop(args)
+        timings[kind] = time.perf_counter() - time_start
+
+  if(saved is not None):
+    click.echo(f'objects.cmo reader: {timings["cmo"]:8.3f} s, compared with the report output "{saved}" ({len(frames_idx)} frame(s))')
+  else:
+    click.echo(f'report: {timings["report"]:8.3f} s, objects.cmo reader: {timings["cmo"]:8.3f} s ({timings["report"]/timings["cmo"]:.2f}x)')
+  mismatch = False
+  for o in ops:
+    if(results['report'].get(o, None) is None)or(results['cmo'].get(o, None) is None):
+      click.echo(f'  {cytosim.opts_dict[o]}: not available from both backends')
+      mismatch = True
+      continue
+    for name, (d, ok) in compare_tables(results['report'][o], results['cmo'][o], atol).items():
+      click.echo(f'  {cytosim.opts_dict[o]} {name:10s}: max difference {d:10.3g} {"OK" if ok else "MISMATCH"}')
+      mismatch = mismatch or not ok
+  if(mismatch):
+    sys.exit(1)
+
+@main.command('png-decode')
+@click.option("--frames", default=200, help="Number of frames per channel.")
+@click.option("--channels", default=3, help="Number of channels.")
+@click.option("--size", default=800, help="Size of the images.")
+@click.option("--fibers", default=500, help="Number of fibers per image.")
+@click.option("--decoders", default=0, help="Number of decoding threads (0: number of cores)")
+def png_decode(frames : int, channels : int, size : int, fibers : int, decoders : int):
+  """Compare the serial two-pass and the single-pass parallel PNG decoding of make_tiff.py."""
+  import make_tiff
+  tmpdirs = [ tempfile.mkdtemp(suffix=f'ch{ich}') for ich in range(channels) ]
+  try:
+    for ich, tdir in enumerate(tmpdirs):
+      synthetic_play_images(tdir, frames, size, fibers, seed=ich)
+    frames_idx = list(range(frames))
+    click.echo(f'{channels} channel(s) x {frames} frame(s) of {size}x{size} pixels, {os.cpu_count()} core(s)')
+
+    # previous make_tiff.py: one pass to check the channel lengths, one to load
+    time_start = time.perf_counter()
+    for tdir in tmpdirs:
+      for frm in frames_idx:
+        make_tiff.read_matplotlib(os.path.join(tdir, f'image{frm:04d}.png'))
+    reference = np.zeros((frames, channels, size, size), dtype=np.uint16)
+    for ich, tdir in enumerate(tmpdirs):
+      for ifrm, frm in enumerate(frames_idx):
+        reference[ifrm, ich] = make_tiff.decode_page(os.path.join(tdir, f'image{frm:04d}.png'), make_tiff.read_matplotlib, False)[0]
+    time_serial = time.perf_counter() - time_start
+    click.echo(f'  {"two-pass serial":24s}: {time_serial:8.3f} s')
+
+    for name, reader in make_tiff.image_readers.items():
+      image_stack = np.zeros_like(reference)
+      try:
+        time_start = time.perf_counter()
+        ch_sz = make_tiff.channel_lengths(tmpdirs, frames_idx)
+        pages = make_tiff.decoded_pages(make_tiff.stack_paths(tmpdirs, frames_idx, ch_sz), size, reader, False, decoders)
+        for ipage, page in enumerate(pages):
+          image_stack[ipage // channels, ipage % channels] = page
+        elapsed = time.perf_counter() - time_start
+      except ImportError as e:
+        click.echo(f'  {"single-pass " + name:24s}: not available ({e})')
+        continue
+      click.echo(f'  {"single-pass " + name:24s}: {elapsed:8.3f} s, speedup {time_serial/elapsed:6.2f}x, identical images: {np.array_equal(image_stack, reference)}')
+  finally:
+    for tdir in tmpdirs:
+      shutil.rmtree(tdir)
+
+@main.command('tiff-encoding')
+@click.option("--frames", default=100, help="Number of frames per channel.")
+@click.option("--channels", default=3, help="Number of channels.")
+@click.option("--size", default=800, help="Size of the images.")
+@click.option("--fibers", default=500, help="Number of fibers per image.")
+@click.option("--compression", default='none,deflate', help="A comma-separated list of compressions to benchmark.")
+def tiff_encoding(frames : int, channels : int, size : int, fibers : int, compression : str):
+  """File size and write/read time of the make_tiff.py encodings."""
+  import tifffile
+  import make_tiff
+  tmpdirs = [ tempfile.mkdtemp(suffix=f'ch{ich}') for ich in range(channels) ]
+  try:
+    for ich, tdir in enumerate(tmpdirs):
+      synthetic_play_images(tdir, frames, size, fibers, seed=ich)
+    frames_idx = list(range(frames))
+    ch_sz = make_tiff.channel_lengths(tmpdirs, frames_idx)
+    masks = [ make_tiff.decode_page(path, make_tiff.read_matplotlib, False, np.bool_)[0] for path in make_tiff.stack_paths(tmpdirs, frames_idx, ch_sz) ]
+    click.echo(f'{channels} channel(s) x {frames} frame(s) of {size}x{size} pixels')
+
+    shape = (frames, 1, channels, size, size, 1)
+    reference = None
+    for name, enc in make_tiff.encodings.items():
+      for comp in compression.split(','):
+        options = dict() if comp == 'none' else { 'compression' : comp }
+        out = os.path.join(tmpdirs[0], f'{name}-{comp}.tiff')
+        pages = ( mask if enc['dtype'] == np.bool_ else np.where(mask, 255, 0).astype(enc['dtype']) for mask in masks )
+        try:
+          time_start = time.perf_counter()
+          with tifffile.TiffWriter(out, byteorder=enc['byteorder'], imagej=enc['imagej']) as tif:
+            tif.write(pages, shape=shape, dtype=enc['dtype'], metadata={} if enc['imagej'] else {'axes':'TZCYXS'}, **options)
+          time_write = time.perf_counter() - time_start
+        except (KeyError, ValueError, ImportError) as e:
+          click.echo(f'  {name:6s} {comp:8s}: not available ({e})')
+          continue
+        time_start = time.perf_counter()
+        with tifffile.TiffFile(out) as imfile:
+          ok = all(np.array_equal(page.asarray() > 0, mask) for page, mask in zip(imfile.series[0].pages, masks))
+        time_read = time.perf_counter() - time_start
+        nbytes = os.path.getsize(out)
+        if(reference is None):
+          reference = nbytes
+        click.echo(f'  {name:6s} {comp:8s}: {nbytes/2**20:8.1f} MB ({reference/nbytes:6.1f}x smaller), write {time_write:7.3f} s, read {time_read:7.3f} s, identical masks: {ok}')
+  finally:
+    for tdir in tmpdirs:
+      shutil.rmtree(tdir)
+
+@main.command('play-passes')
+@click.option("--frames", default=20, help="Number of frames.")
+@click.option("--channels", default=3, help="Number of channels.")
+@click.option("--size", default=800, help="Size of the images.")
+@click.option("--cost", default=0.1, help="CPU time in seconds the stand-in play spends on every frame.")
+@click.option("--encoding", default='uint16', help="Pixel encoding of the dataset, see make_tiff.py --encoding.")
+def play_passes(frames : int, channels : int, size : int, cost : float, encoding : str):
+  """Time make_tiff.py with one play run per channel and with a single pass."""
+  import tifffile
+  import make_tiff
+  with tempfile.TemporaryDirectory() as bindir, tempfile.TemporaryDirectory() as simdir:
+    standin_play(bindir, size, cost)
+    os.environ['CYTOSIMBINPATH'] = bindir
+    names = [ f'fiber{ich}' for ich in range(channels) ]
+    with open(os.path.join(simdir, 'properties.cmo'), 'w') as handle:
+      for name in names:
+        handle.write(f'set fiber {name}\n{{\n display = (color=red;)\n}}\n')
+    with open(os.path.join(simdir, 'objects.cmo'), 'w') as handle:
+      pass
+
+    click.echo(f'{channels} channel(s) x {frames} frame(s) of {size}x{size} pixels, {cost} s per frame')
+    stacks = dict()
+    for mode, flags in [('per channel', []), ('single pass', ['--single-pass'])]:
+      out = os.path.join(simdir, f'{len(flags)}.tiff')
+      argv = ['--simdir', simdir, '--channels', ','.join(names), '--size', str(size), '--out', out,
+              '--frames', ','.join(map(str, range(frames))), '--encoding', encoding] + flags
+      with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        time_start = time.perf_counter()
+        make_tiff.main.main(argv, standalone_mode=False)
+        elapsed = time.perf_counter() - time_start
+      with tifffile.TiffFile(out) as imfile:
+        stacks[mode] = imfile.asarray() > 0
+        ij = imfile.imagej_metadata or dict()
+      layout = f'ImageJ {ij.get("frames", 1)} frame(s) x {ij.get("channels", 1)} channel(s)' if ij else f'{imfile.series[0].axes} {imfile.series[0].shape}'
+      click.echo(f'  {mode:12s}: {elapsed:8.3f} s, {frames * (1 if flags else channels)} frame(s) rendered, {layout}')
+    # entities drawn over each other hide one another in a single pass
+    same = np.mean(stacks["per channel"] == stacks["single pass"])
+    click.echo(f'  matching pixels: {100*same:.2f}% (the others are occluded by another channel)')
+
+@main.command('rasterizer')
+@click.option("--frames", default=100, help="Number of frames.")
+@click.option("--fibers", default=500, help="Number of fibers per channel and frame.")
+@click.option("--channels", default=2, help="Number of fiber channels.")
+@click.option("--size", default=800, help="Size of the images.")
+@click.option("--workers", default=','.join(map(str, [1, 2, 4, 8])), help="A comma-separated list of worker process counts.")
+def rasterizer(frames : int, fibers : int, channels : int, size : int, workers : str):
+  """Speedup of the NumPy rasterizer of make_tiff.py over worker processes."""
+  import raster
+  with tempfile.TemporaryDirectory() as simdir:
+    names = [ f'fiber{ich}' for ich in range(channels) ]
+    synthetic_cmo(simdir, frames, fibers, names)
+    click.echo(f'{channels} channel(s) x {frames} frame(s) x {fibers} fiber(s) of 10 vertices, {size}x{size} pixels, {os.cpu_count()} core(s)')
+    reference, time_single = None, None
+    for n in map(int, workers.split(',')):
+      time_start = time.perf_counter()
+      stack = np.stack(list(raster.rendered_frames(simdir, list(range(frames)), names, size, workers=n)))
+      elapsed = time.perf_counter() - time_start
+      if(reference is None):
+        reference, time_single = stack, elapsed
+      click.echo(f'  {n:3d} worker(s): {elapsed:8.3f} s, {frames/elapsed:8.1f} frames/s, speedup {time_single/elapsed:6.2f}x, '
+                 f'lit pixels {100*np.mean(stack):.2f}%, identical frames: {np.array_equal(stack, reference)}')
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import mmap
+import pickle
+
+import numpy as np
+
+import framestore
+
+###
+# objects.cmo reader
+###
+
+# fields of a fiber record written before its vertices (Chain::write), then
+# the number of vertices and DIM coordinates per vertex; anything after the
+# vertices (dynamic states of the ends) is ignored
+FIBER_HEADER = ('signature', 'segmentation', 'abscissaM')
+
+# frame start & frame sections
+CMO_FRAME = b'#Cytosim'
+CMO_TIME = b'#time'
+CMO_SECTION = b'#section'
+CMO_BINARY = b'#binary'
+
+# object reference: tag, property index, identity and optional mark (e.g. 'f1:12')
+re_reference = re.compile(rb'^([A-Za-z])(\d+):(\d+)(?::\d+)?', re.M)
+re_dim = re.compile(rb'\bdim\s+(\d+)')
+
+def fiber_classes(simdir):
+  """
+  Fiber class names by property index, in the order of 'set fiber NAME' in properties.cmo
+  """
+  names = dict()
+  filepath = os.path.join(simdir, 'properties.cmo')
+  if(not os.path.isfile(filepath)):
+    return names
+  with open(filepath, 'r') as handle:
+    for line in handle:
+      if line.startswith('set fiber'):
+        names[len(names) + 1] = line.split()[2]
+  return names
+
+def is_text(filepath):
+  """
+  True if a trajectory is written as text (binary_output=0), the only format
+  CmoReader decodes; cytosim writes binary trajectories by default
+  """
+  reader = CmoReader(filepath)
+  return (len(reader) == 0)or(CMO_BINARY not in reader.frame_bytes(0))
+
+class CmoReader:
+  """
+  Experimental pure NumPy reader for text cytosim trajectories
+    filepath : path to objects.cmo
+    dim      : space dimension (read from the frame header when present)
+
+  Frames are located by their '#Cytosim' header line; frame i of the reader is
+  frame i of the 'report' executable. The frame offsets come from the
+  persistent index (see frame_index). Binary frames are not decoded (see
+  is_text), and the columns of fiber_report are checked against the output
+  of 'report' with benchmark.py cmo-reader.
+  """
+  def __init__(self, filepath, dim=2):
+    self._filepath = filepath
+    self._dim = dim
+    self._offsets = None
+    self._times = None
+
+  def __len__(self):
+    return len(self.offsets)
+
+  @property
+  def offsets(self):
+    if(self._offsets is None):
+      index = frame_index(self._filepath)
+      self._offsets, self._times = index['offsets'].tolist(), index['times']
+    return self._offsets
+
+  @property
+  def times(self):
+    self.offsets
+    return self._times
+
+  def frame_bytes(self, frm):
+    """Raw bytes of a given frame"""
+    offsets = self.offsets
+    start = offsets[frm]
+    stop = offsets[frm+1] if frm + 1 < len(offsets) else os.path.getsize(self._filepath)
+    with open(self._filepath, 'rb') as handle:
+      handle.seek(start)
+      return handle.read(stop - start)
+
+  def fibers(self, frm):
+    """
+    Fibers of a given frame
+    returns a dict with the property index ('class'), 'identity' and number of
+    vertices ('size') of every fiber, and all vertices ('points', shape (sum(size), dim))
+    """
+    data = self.frame_bytes(frm)
+    if(CMO_BINARY in data):
+      raise RuntimeError(f'frame {frm} of "{self._filepath}" is binary, which is not supported (use the report backend)')
+    dim = self._dim
+    match = re_dim.search(data[:data.find(CMO_SECTION)])
+    if(match is not None):
+      dim = int(match.group(1))
+
+    classes, identities, sizes, points = [], [], [], []
+    for section in data.split(CMO_SECTION)[1:]:
+      if(not section.lstrip().startswith(b'fiber')):
+        continue
+      refs = list(re_reference.finditer(section))
+      for iref, ref in enumerate(refs):
+        stop = refs[iref+1].start() if iref + 1 < len(refs) else section.find(b'\n#')
+        vals = np.fromstring(section[ref.end():stop if stop >= 0 else len(section)], dtype=np.float64, sep=' ')
+        size = int(vals[len(FIBER_HEADER)])
+        start = len(FIBER_HEADER) + 1
+        if(len(vals) < start + dim*size):
+          raise RuntimeError(f'frame {frm}: fiber record {ref.group(0).decode()} is shorter than expected')
+        classes.append(int(ref.group(2)))
+        identities.append(int(ref.group(3)))
+        sizes.append(size)
+        points.append(vals[start:start + dim*size])
+
+    return { 'class' : np.array(classes, dtype=np.int64), 'identity' : np.array(identities, dtype=np.int64),
+             'size' : np.array(sizes, dtype=np.int64),
+             'points' : np.concatenate(points).reshape(-1, dim) if len(points) else np.zeros((0, dim)) }
+
+def scan_frames(filepath, start=0):
+  """
+  Byte offsets and times of all frames of a trajectory, from a given byte offset on
+  """
+  offsets, times = [], []
+  if(os.path.getsize(filepath) <= start):
+    return offsets, times
+  with open(filepath, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+    pos = start
+    while True:
+      if(data[pos:pos+len(CMO_FRAME)] == CMO_FRAME)and((pos == 0)or(data[pos-1:pos] == b'\n')):
+        offsets.append(pos)
+        tpos = data.find(b'\n' + CMO_TIME, pos)
+        nxt = data.find(b'\n' + CMO_FRAME, pos)
+        if(tpos >= 0)and((nxt < 0)or(tpos < nxt)):
+          times.append(float(data[tpos+1+len(CMO_TIME):data.find(b'\n', tpos+1)].split()[0]))
+        else:
+          times.append(np.nan)
+      pos = data.find(b'\n' + CMO_FRAME, pos)
+      if(pos < 0):
+        break
+      pos += 1
+  return offsets, times
+
+###
+# Persistent frame index
+###
+
+# sidecar file with the frame offsets of a trajectory
+CMO_INDEX_SUFFIX = '.idx'
+CMO_INDEX_VERSION = 1
+
+def frame_index(filepath, save=True):
+  """
+  Byte offsets and times of all frames of a trajectory, cached in a sidecar file
+    filepath : path to objects.cmo
+    save     : write the updated index next to the trajectory
+  returns a dict with the trajectory 'size' and 'mtime' and the frame 'offsets' and 'times'
+
+  The index is valid as long as the size and the modification time of the
+  trajectory match. If the trajectory grew, only its tail is scanned, starting
+  from the last indexed frame (which may have been incomplete).
+  """
+  stat = os.stat(filepath)
+  sidecar = filepath + CMO_INDEX_SUFFIX
+  index = None
+  if(os.path.isfile(sidecar)):
+    try:
+      with open(sidecar, 'rb') as handle:
+        index = pickle.load(handle)
+      if(index.get('version', None) != CMO_INDEX_VERSION):
+        index = None
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+      index = None
+
+  if(index is not None)and(index['size'] == stat.st_size)and(index['mtime'] == stat.st_mtime_ns):
+    return index
+
+  offsets, times = [], []
+  if(index is not None)and(index['size'] < stat.st_size)and(len(index['offsets'])):
+    # the trajectory grew: keep the frames before the last indexed one if it is still in place
+    start = int(index['offsets'][-1])
+    with open(filepath, 'rb') as handle:
+      handle.seek(start)
+      if(handle.read(len(CMO_FRAME)) == CMO_FRAME):
+        offsets, times = index['offsets'][:-1].tolist(), index['times'][:-1].tolist()
+      else:
+        start = 0
+  else:
+    start = 0
+
+  new_offsets, new_times = scan_frames(filepath, start)
+  index = { 'version' : CMO_INDEX_VERSION, 'size' : stat.st_size, 'mtime' : stat.st_mtime_ns,
+            'offsets' : np.array(offsets + new_offsets, dtype=np.int64), 'times' : np.array(times + new_times, dtype=np.float64) }
+
+  if(save):
+    try:
+      tmp = sidecar + '.tmp'
+      with open(tmp, 'wb') as handle:
+        pickle.dump(index, handle, protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp, sidecar)
+    except OSError as e:
+      print(f'could not write the frame index "{sidecar}": {e}')
+  return index
+
+###
+# report-equivalent columns
+###
+
+def fiber_report(fibers, op, classes=None):
+  """
+  Compute the columns of a 'report' operation from the fiber vertices
+    fibers  : dict returned by CmoReader.fibers
+    op      : 'fiber:position', 'fiber:end' or 'fiber:length'
+    classes : fiber class names by property index
+
+  As in report, posC is the point at half the length of the fiber along its
+  segments, dirC the direction of the segment holding this point and cosC the
+  cosine between the directions of the minus and the plus ends.
+  """
+  size = fibers['size']
+  points = fibers['points']
+  last = np.cumsum(size) - 1
+  first = last - size + 1
+  posM = points[first]
+  posP = points[last]
+  if(op == 'fiber:end'):
+    return { 'identity' : fibers['identity'], 'posM' : posM, 'posP' : posP }
+
+  # segment lengths
+  seg = np.diff(points, axis=0)
+  seg_len = np.zeros(len(points))
+  seg_len[:-1] = np.sqrt(np.sum(seg**2, axis=1))
+  seg_len[last] = 0.0 # links between consecutive fibers
+  length = np.add.reduceat(seg_len, first) if len(first) else np.zeros(0)
+  length[size < 2] = 0.0
+
+  if(op == 'fiber:position'):
+    # the segments of a fiber have the same length, so the abscissa length/2 of
+    # report (Chain::interpolateM) lies nseg/2 segments from the minus end
+    nseg = np.maximum(size - 1, 0)
+    iseg = first + np.minimum(nseg // 2, np.maximum(nseg - 1, 0))
+    frac = 0.5*nseg - nseg // 2
+    seg_c = seg[np.minimum(iseg, len(seg)-1)] if len(seg) else np.zeros(posM.shape)
+    posC = points[iseg] + frac[:, None] * seg_c
+    with np.errstate(invalid='ignore', divide='ignore'):
+      dirC = seg_c / np.sqrt(np.sum(seg_c**2, axis=1))[:, None]
+      dirM = seg[np.minimum(first, len(seg)-1)] if len(seg) else np.zeros(posM.shape)
+      dirP = seg[np.maximum(last - 1, 0)] if len(seg) else np.zeros(posP.shape)
+      cosC = np.sum(dirM * dirP, axis=1) / (np.sqrt(np.sum(dirM**2, axis=1)) * np.sqrt(np.sum(dirP**2, axis=1)))
+    # a single vertex has no direction
+    dirC[size < 2] = np.nan
+    cosC[size < 2] = np.nan
+    return { 'identity' : fibers['identity'], 'posC' : posC, 'dirC' : dirC, 'cosC' : cosC }
+
+  if(op == 'fiber:length'):
+    names = classes if classes is not None else dict()
+    cols = { 'class' : [], 'count' : [], 'avg' : [], 'dev' : [], 'min' : [], 'max' : [], 'tot' : [] }
+    for cls in np.unique(fibers['class']):
+      lens = length[fibers['class'] == cls]
+      cols['class'].append(names.get(int(cls), str(cls)))
+      cols['count'].append(len(lens))
+      cols['avg'].append(np.mean(lens))
+      cols['dev'].append(np.std(lens))
+      cols['min'].append(np.min(lens))
+      cols['max'].append(np.max(lens))
+      cols['tot'].append(np.sum(lens))
+    return { name : np.array(col, dtype=str if name == 'class' else np.float64) for name, col in cols.items() }
+
+  raise RuntimeError(f'operation "{op}" is not available from objects.cmo')
+
+# report operations available from objects.cmo
+cmo_ops = ['fiber:position', 'fiber:end', 'fiber:length']
+
+def read_report(simdir, ops, frames=None):
+  """
+  Read report-equivalent FrameTables straight from simdir/objects.cmo
+    simdir : simulation directory
+    ops    : list of report operations (see cmo_ops)
+    frames : list of frame indexes, defaults to all frames
+  returns a dict of FrameTables keyed by operation
+  """
+  reader = CmoReader(os.path.join(simdir, 'objects.cmo'))
+  classes = fiber_classes(simdir)
+  if(frames is None):
+    frames = range(len(reader))
+  builders = { op : framestore.FrameTableBuilder(op) for op in ops }
+  for frm in frames:
+    if(frm >= len(reader)):
+      print(f'frame {frm} is not in the trajectory ({len(reader)} frames)')
+      break
+    fibers = reader.fibers(frm)
+    for op in ops:
+      builders[op].append(frm, fiber_report(fibers, op, classes))
+  return { op : builder.build() for op, builder in builders.items() }
@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import sys
 
 import asyncio
-import pickle
+import collections
+import concurrent.futures
 import time
 #import locale
 import traceback
+import warnings
+
+import numpy as np
+
+import framestore
+import cmoreader
+import summary
 
 
 CS_FIBER_CLUS = 'clus'
@@ -19,6 +28,165 @@ CS_SINGLE_FORCE = 'single-force'
 
 opts_dict = { CS_FIBER_CLUS : 'fiber:cluster', CS_FIBER_POS : 'fiber:position', CS_FIBER_END : 'fiber:end', CS_FIBER_LEN : 'fiber:length', CS_SINGLE_FORCE : 'single:force' }
 
+###
+# Vectorized parsing
+###
+
+# column layout of the fixed-width 'report' outputs (zero-based column indexes)
+report_columns = {
+  'fiber_position' : { 'identity' : 1, 'posC' : slice(3,5), 'dirC' : slice(5,7), 'cosC' : 8 },
+  'fiber_end'      : { 'identity' : 1, 'posM' : slice(4,6), 'posP' : slice(9,11) },
+  'single_force'   : { 'class' : 0, 'identity' : 1, 'fiber' : 2, 'pos' : slice(3,5), 'force' : slice(5,7) },
+}
+
+# integer columns of the fixed-width outputs
+report_integer_columns = ['class', 'identity', 'fiber']
+
+# outputs whose rows must have exactly this many columns, with the expected layout
+report_widths = {
+  'single_force' : (7, 'class identity fiber posX posY forceX forceY'),
+}
+
+def check_report_width(op_name, ncols):
+  """
+  Raise a RuntimeError if the rows of an output do not have the expected number of columns
+  """
+  if(op_name in report_widths)and(ncols != report_widths[op_name][0]):
+    width, layout = report_widths[op_name]
+    raise RuntimeError(f'{op_name.replace("_", ":", 1)} rows have {ncols} column(s), expected {width} ({layout}); '
+                       'this version of report writes a different layout')
+
+def force_magnitude(force):
+  """Norm of every row of a (n, 2) force array"""
+  return np.hypot(force[:, 0], force[:, 1])
+
+report_length_columns = ['count', 'avg', 'dev', 'min', 'max', 'tot']
+
+def _parse_numeric_block(block):
+  """
+  Decode a block of whitespace-separated numbers into a 2-D array
+    block : raw bytes, one row per line
+  returns None if the rows do not have the same number of columns
+  """
+  ncols = _row_widths(block)
+  if(len(ncols) == 0)or(np.any(ncols != ncols[0])):
+    return None
+  # fromstring stops at the first token it cannot convert and warns about it
+  with warnings.catch_warnings():
+    warnings.simplefilter('error', DeprecationWarning)
+    try:
+      vals = np.fromstring(bytes(block), dtype=np.float64, sep=' ')
+    except (ValueError, DeprecationWarning):
+      return None
+  if(len(vals) != len(ncols) * ncols[0]):
+    return None
+  return vals.reshape(len(ncols), ncols[0])
+
+def _row_widths(block):
+  """Number of whitespace-separated tokens of every non-blank line of a block"""
+  buf = np.frombuffer(bytes(block), dtype=np.uint8)
+  space = (buf == ord(' ')) | (buf == ord('\t')) | (buf == ord('\r')) | (buf == ord('\n'))
+  # first byte of every token
+  start = ~space
+  start[1:] &= space[:-1]
+  line = np.cumsum(buf == ord('\n'))
+  ncols = np.bincount(line[start])
+  return ncols[ncols > 0]
+
+def parse_report_block(op_name, block):
+  """
+  Convert all data lines of one frame into a dict of NumPy arrays
+    op_name : parser name (e.g. 'fiber_position')
+    block   : raw bytes of the frame data lines, each terminated by a new line
+  returns None if the block cannot be decoded in one call
+  """
+  if(op_name in report_columns):
+    vals = _parse_numeric_block(block)
+    if(vals is None):
+      return None
+    check_report_width(op_name, vals.shape[1])
+    cols = dict()
+    for name, idx in report_columns[op_name].items():
+      if(isinstance(idx, slice))and(vals.shape[1] < idx.stop):
+        return None
+      if(not isinstance(idx, slice))and(vals.shape[1] <= idx):
+        return None
+      cols[name] = np.ascontiguousarray(vals[:, idx])
+    for name in report_integer_columns:
+      if(name in cols):
+        cols[name] = cols[name].astype(np.int64)
+    if(op_name == 'single_force'):
+      cols['magnitude'] = force_magnitude(cols['force'])
+    return cols
+  elif(op_name == 'fiber_length'):
+    rows = [ r.split() for r in bytes(block).split(b'\n') if len(r.strip()) ]
+    ncols = len(report_length_columns) + 1
+    if(len(rows) == 0)or(any(len(r) < ncols for r in rows)):
+      return None
+    try:
+      vals = np.array([ r[1:ncols] for r in rows ], dtype=np.float64)
+    except ValueError:
+      return None
+    cols = { 'class' : np.array([ r[0].decode('ascii') for r in rows ]) }
+    for i, name in enumerate(report_length_columns):
+      cols[name] = vals[:, i]
+    return cols
+  elif(op_name == 'fiber_cluster'):
+    stats, members = [], []
+    for r in bytes(block).split(b'\n'):
+      r = r.split(b':')
+      if(len(r) < 2):
+        continue
+      stats.append(r[0].split()[0])
+      members.append(r[1])
+    try:
+      identity = np.array(stats, dtype=np.int64)
+      size = np.array([ len(m.split()) for m in members ], dtype=np.int64)
+      fibers = np.array(b' '.join(members).split(), dtype=np.int64)
+    except (ValueError, IndexError):
+      return None
+    return { 'identity' : identity, 'size' : size, 'fibers' : fibers }
+  return None
+
+# variable-length columns: name -> column with the number of elements per row
+report_ragged = {
+  'fiber_cluster' : { 'fibers' : 'size' },
+}
+
+def dict_to_block(op_name, frame):
+  """
+  Convert the per-frame dict filled by the line-by-line parsers into the
+  arrays returned by parse_report_block
+  """
+  if(op_name == 'fiber_position'):
+    vals = list(frame.values())
+    return { 'identity' : np.array(list(frame.keys()), dtype=np.int64),
+             'posC' : np.array([ v[0] for v in vals ], dtype=np.float64).reshape(-1, 2),
+             'dirC' : np.array([ v[1] for v in vals ], dtype=np.float64).reshape(-1, 2),
+             'cosC' : np.array([ v[2] for v in vals ], dtype=np.float64) }
+  elif(op_name == 'fiber_end'):
+    vals = list(frame.values())
+    return { 'identity' : np.array(list(frame.keys()), dtype=np.int64),
+             'posM' : np.array([ v[0] for v in vals ], dtype=np.float64).reshape(-1, 2),
+             'posP' : np.array([ v[1] for v in vals ], dtype=np.float64).reshape(-1, 2) }
+  elif(op_name == 'fiber_length'):
+    cols = { 'class' : np.array(frame['class'], dtype=str) }
+    for name in report_length_columns:
+      cols[name] = np.array(frame[name], dtype=np.float64)
+    return cols
+  elif(op_name == 'single_force'):
+    cols = { name : np.array(frame[name], dtype=np.int64) for name in ['class', 'identity', 'fiber'] }
+    cols['pos'] = np.array(frame['pos'], dtype=np.float64).reshape(-1, 2)
+    cols['force'] = np.array(frame['force'], dtype=np.float64).reshape(-1, 2)
+    cols['magnitude'] = force_magnitude(cols['force'])
+    return cols
+  elif(op_name == 'fiber_cluster'):
+    vals = list(frame.values())
+    return { 'identity' : np.array(list(frame.keys()), dtype=np.int64),
+             'size' : np.array([ len(v) for v in vals ], dtype=np.int64),
+             'fibers' : np.array([ f for v in vals for f in v ], dtype=np.int64) }
+  return None
+
 ###
 # Report
 ###
@@ -30,8 +198,19 @@ class CytosimReportProtocol(asyncio.SubprocessProtocol):
     done_future : future semaphore
     op          : operation (one of the listed above)
     simdir      : data & output directory
+    vectorized  : collect each frame as raw bytes and decode it in one call
+    stream      : append every finished frame to the output file instead of keeping it in memory
+    pool        : executor that decodes the frame blocks off the event loop (implies vectorized)
+    max_pending : number of frames queued in the pool before the pipe reading is paused
+    save        : write the results to simdir/fname when the process exits
+    verbose     : output level, 0: errors only, 1: frame progress, 2: echo the output of 'report'
+    reducers    : list of summary.Reducer, per-frame summaries computed while the frames stream in
+    queue       : asyncio.Queue that receives (op, frame, columns) for every parsed frame instead of
+                  keeping the frames, followed by (op, None, None) when the process is done or by
+                  (op, None, exception) when it failed
+    max_queued  : number of frames waiting in the queue before the pipe reading is paused
   """
-  def __init__(self, done_future, op, simdir, fname):
+  def __init__(self, done_future, op, simdir, fname, vectorized=True, stream=False, pool=None, max_pending=None, save=True, verbose=1, reducers=None, queue=None, max_queued=None):
     super().__init__()
     self._done_future = done_future
     self._op_name = opts_dict.get(op, lambda: 'invalid').replace(':','_')
@@ -40,11 +219,36 @@ class CytosimReportProtocol(asyncio.SubprocessProtocol):
       raise RuntimeError('invalid operation')
     self._simdir = simdir
     self._fname = fname
+    self._save = save
 
     self._frm_idx = None
-    self._buf = None
-    self._data = dict()
-    print(f"CytosimReportProtocol init")
+    self._buf = bytearray()
+    self._verbose = verbose
+    self._vectorized = vectorized or (pool is not None)
+    self._pool = pool
+    self._max_pending = max_pending if max_pending is not None else 2*getattr(pool, '_max_workers', 1)
+    self._pending = collections.deque()
+    self._queue = queue
+    self._max_queued = max_queued if max_queued is not None else 16
+    self._op = op
+    self._paused = False
+    self._exited = False
+    self._closed = False
+    self._failed = False
+    self._transport = None
+    self._block = None
+    self._frame = None
+    self._summary = None
+    if(len(summary.for_op(reducers, opts_dict[op]))):
+      self._summary = summary.SummaryBuilder(opts_dict[op], summary.for_op(reducers, opts_dict[op]))
+    if(queue is not None):
+      self._data = None
+    elif(stream):
+      self._data = framestore.FrameStreamWriter(os.path.join(simdir, fname), simdir, opts_dict[op], report_ragged.get(self._op_name, None))
+    else:
+      self._data = framestore.FrameTableBuilder(opts_dict[op], report_ragged.get(self._op_name, None))
+    if(self._verbose > 0):
+      print(f"CytosimReportProtocol init")
   
   #
   # Single
@@ -52,18 +256,30 @@ class CytosimReportProtocol(asyncio.SubprocessProtocol):
   
   def single_force(self, line):
     if(line is None):
-      pass
-      #self._data[self._frm_idx] = { 'count' : [], 'avg' : [], 'dev' : [], 'min' : [], 'max' : [], 'tot' : [] }
-    if(line is not None):
-      print('single_force: ' + line)
-    
+      self._frame = { 'class' : [], 'identity' : [], 'fiber' : [], 'pos' : [], 'force' : [] }
+    else:
+      if(len(line) == 0):
+        return
+      try:
+        cols = line.split(' ')
+        cols = list(map(float, filter(lambda x: len(x) > 0, cols)))
+      except:
+        print('conversion failed: ' + line)
+        return
+      check_report_width(self._op_name, len(cols))
+      self._frame['class'].append(int(cols[0]))
+      self._frame['identity'].append(int(cols[1]))
+      self._frame['fiber'].append(int(cols[2]))
+      self._frame['pos'].append(cols[3:5])
+      self._frame['force'].append(cols[5:7])
+
   #
   # Fiber analysis
   #
 
   def fiber_length(self, line):
     if(line is None):
-      self._data[self._frm_idx] = { 'count' : [], 'avg' : [], 'dev' : [], 'min' : [], 'max' : [], 'tot' : [] }
+      self._frame = { 'class' : [], 'count' : [], 'avg' : [], 'dev' : [], 'min' : [], 'max' : [], 'tot' : [] }
     else:
       if(len(line) == 0):
         return
@@ -80,16 +296,17 @@ class CytosimReportProtocol(asyncio.SubprocessProtocol):
       len_min = cols[3]
       len_max = cols[4]
       len_tot = cols[5]
-      self._data[self._frm_idx]['count'].append(cnt)
-      self._data[self._frm_idx]['avg'].append(len_avg)
-      self._data[self._frm_idx]['dev'].append(len_dev)
-      self._data[self._frm_idx]['min'].append(len_min)
-      self._data[self._frm_idx]['max'].append(len_max)
-      self._data[self._frm_idx]['tot'].append(len_tot)
+      self._frame['class'].append(fclass)
+      self._frame['count'].append(cnt)
+      self._frame['avg'].append(len_avg)
+      self._frame['dev'].append(len_dev)
+      self._frame['min'].append(len_min)
+      self._frame['max'].append(len_max)
+      self._frame['tot'].append(len_tot)
 
   def fiber_end(self, line):
     if(line is None):
-      self._data[self._frm_idx] = dict()
+      self._frame = dict()
     else:
       if(len(line) == 0):
         return
@@ -108,11 +325,11 @@ class CytosimReportProtocol(asyncio.SubprocessProtocol):
       #stateP = cols[8]
       posP = cols[9:11]
       #dirP = cols[11:13]
-      self._data[self._frm_idx][identity] = [posM, posP]
+      self._frame[identity] = [posM, posP]
 
   def fiber_position(self, line):
     if(line is None):
-      self._data[self._frm_idx] = dict()
+      self._frame = dict()
     else:
       if(len(line) == 0):
         return
@@ -130,12 +347,12 @@ class CytosimReportProtocol(asyncio.SubprocessProtocol):
       #end2end = cols[7]
       cosC = cols[8]
       #aster = cols[9]
-      self._data[self._frm_idx][identity] = [posC, dirC, cosC]
+      self._frame[identity] = [posC, dirC, cosC]
 
   def fiber_cluster(self, line):
     #print(f'CytosimReportProtocol fiber_cluster: {self._frm_idx} -> {line}')
     if(line is None):
-      self._data[self._frm_idx] = dict()
+      self._frame = dict()
     else:
       line = line.split(':')
       if(len(line) < 2):
@@ -148,64 +365,253 @@ class CytosimReportProtocol(asyncio.SubprocessProtocol):
       except:
         print('conversion failed: ' + line)
         return
-      self._data[self._frm_idx][identity] = fibers
+      self._frame[identity] = fibers
 
   #
   # pipe-driven I/O
   #
   
+  # frame begin
+  def _begin_frame(self):
+    if(self._vectorized):
+      self._block = bytearray()
+    else:
+      self._parser(None)
+
+  # parse a frame block line by line
+  def _parse_lines(self, block):
+    self._parser(None)
+    for line in block.decode('ascii').split('\n'):
+      if(len(line)):
+        self._parser(line)
+    cols = dict_to_block(self._op_name, self._frame) if self._frame is not None else None
+    self._frame = None
+    return cols
+
+  # store a parsed frame
+  def _store(self, frm, cols):
+    if(cols is not None):
+      if(self._queue is not None):
+        self._queue.put_nowait((self._op, frm, cols))
+        self._update_reading()
+      else:
+        self._data.append(frm, cols)
+      if(self._summary is not None):
+        self._summary.append(frm, cols)
+
+  # frame end
+  def _end_frame(self):
+    if(self._block is not None):
+      block, self._block = self._block, None
+      if(self._pool is not None):
+        self._submit(self._frm_idx, block)
+        return
+      cols = parse_report_block(self._op_name, block)
+      if(cols is None):
+        # fall back to the line-by-line parser
+        cols = self._parse_lines(block)
+      self._store(self._frm_idx, cols)
+    elif(self._frame is not None):
+      cols = dict_to_block(self._op_name, self._frame)
+      self._frame = None
+      self._store(self._frm_idx, cols)
+
+  #
+  # worker pool
+  #
+
+  # hand a frame block over to the pool
+  def _submit(self, frm, block):
+    future = asyncio.get_event_loop().run_in_executor(self._pool, parse_report_block, self._op_name, bytes(block))
+    self._pending.append((frm, block, future))
+    future.add_done_callback(self._drain)
+    self._update_reading()
+
+  # store the decoded frames in frame order
+  def _drain(self, future=None):
+    if(self._failed):
+      return
+    try:
+      while(len(self._pending))and(self._pending[0][2].done()):
+        frm, block, future = self._pending.popleft()
+        # raises the errors of the worker (e.g. a broken pool)
+        cols = future.result()
+        if(cols is None):
+          cols = self._parse_lines(block)
+        self._store(frm, cols)
+    except Exception as e:
+      self._fail(e)
+      return
+    self._update_reading()
+    self._try_finish()
+
+  # a frame could not be parsed or stored: hand the error over to the job and stop 'report'
+  def _fail(self, exc):
+    if(self._failed):
+      return
+    self._failed = True
+    print(f"CytosimReportProtocol failed in frame {self._frm_idx}: {exc!r}")
+    for frm, block, future in self._pending:
+      future.cancel()
+    self._pending.clear()
+    if(isinstance(self._data, framestore.FrameStreamWriter)):
+      self._data.close()
+    if(self._queue is not None):
+      # the consumer waits on the queue, not on done_future
+      self._queue.put_nowait((self._op, None, exc))
+    if(not self._done_future.done()):
+      self._done_future.set_exception(exc)
+    if(self._transport is not None):
+      self._transport.close()
+
+  # backpressure: stop reading from 'report' while the pool or the consumer of the queue is behind
+  def _update_reading(self):
+    pipe = self._transport.get_pipe_transport(1) if self._transport is not None else None
+    if(pipe is None)or(self._closed):
+      return
+    busy = (len(self._pending) >= self._max_pending)or((self._queue is not None)and(self._queue.qsize() >= self._max_queued))
+    if(busy)and(not self._paused):
+      pipe.pause_reading()
+      self._paused = True
+    elif(not busy)and(self._paused):
+      pipe.resume_reading()
+      self._paused = False
+
+  # the consumer took a frame out of the queue
+  def frame_consumed(self):
+    self._update_reading()
+
   # data received handle
   def pipe_data_received(self, fd, data):
-    print(f"CytosimReportProtocol pipe_data_received: " + data.decode('ascii').rstrip())
-    if(1 == fd):
-      lines = data.decode('ascii')
-      if(self._buf is not None):
-        lines = self._buf + lines
-        self._buf = None
-      if(lines[-1] != '\n'):
-        pos = lines.rfind('\n')
-        self._buf = lines[(pos+1):]
-        if pos == -1: return
-        lines = lines[:pos]
-
-      lines = lines.split('\n')
-      for line in lines:
-        line = line.rstrip()
-        if(line[0:2] == '% '):
-          # service line
-          serv_str = line[2:]
-          if(serv_str[0:5] == 'frame'):
-            self._frm_idx = int(serv_str[5:].strip())
-            print(f'processing frame index {self._frm_idx}')
-            self._parser(None)
-          if(serv_str[0:3] == 'end'):
-            if(self._frm_idx is None):
-              print('something went wrong: a frame ended before it began')
-            else:
-              print(f'frame index {self._frm_idx} DONE')
-              self._frm_idx = None
-          continue # ignore other service lines
-        if( self._frm_idx is not None)and(len(line)):
-          self._parser(line)
+    if(1 == fd)and(not self._failed):
+      if(self._verbose > 1):
+        print(f"CytosimReportProtocol pipe_data_received: " + data.decode('ascii', 'replace').rstrip())
+      self._buf += data
+      try:
+        used = self._frame_lines(self._buf)
+      except Exception as e:
+        self._fail(e)
+        return
+      if(used):
+        del self._buf[:used]
     if(2 == fd):
-      print(f"CytosimReportProtocol pipe_data_received stderr: " + data.decode('ascii').rstrip())
+      print(f"CytosimReportProtocol pipe_data_received stderr: " + data.decode('ascii', 'replace').rstrip())
+
+  # service line (without the leading '% ')
+  def _service_line(self, serv_str):
+    if(serv_str[0:5] == b'frame'):
+      self._frm_idx = int(serv_str[5:].strip())
+      if(self._verbose > 0):
+        print(f'processing frame index {self._frm_idx}')
+      self._begin_frame()
+    if(serv_str[0:3] == b'end'):
+      if(self._frm_idx is None):
+        print('something went wrong: a frame ended before it began')
+      else:
+        self._end_frame()
+        if(self._verbose > 0):
+          print(f'frame index {self._frm_idx} DONE')
+        self._frm_idx = None
+    # ignore other service lines
+
+  # split the complete lines of the input buffer at the service lines
+  def _frame_lines(self, buf):
+    """
+    Hand the complete lines of buf over to the frame parser
+      buf : bytearray with the pending output of 'report'
+    returns the number of bytes consumed
+
+    Only the service lines ('% ...') are located and copied; the data lines
+    between two of them are appended to the frame block as one slice.
+    """
+    end = buf.rfind(b'\n') + 1
+    if(end == 0):
+      return 0
+    view = memoryview(buf)
+    try:
+      pos = 0
+      while(pos < end):
+        if(buf.startswith(b'% ', pos)):
+          eol = buf.find(b'\n', pos, end)
+          self._service_line(bytes(view[pos+2:eol]).rstrip())
+          pos = eol + 1
+          continue
+        # data lines up to the next service line
+        nxt = buf.find(b'\n% ', pos, end)
+        stop = nxt + 1 if nxt >= 0 else end
+        if(self._frm_idx is not None):
+          if(self._block is not None):
+            self._block += view[pos:stop]
+          else:
+            for line in bytes(view[pos:stop]).decode('ascii').split('\n'):
+              line = line.rstrip()
+              if(len(line)):
+                self._parser(line)
+        pos = stop
+    finally:
+      view.release()
+    return end
+
+  # process started
+  def connection_made(self, transport):
+    self._transport = transport
+
+  # stdout closed, all the output of 'report' was received
+  def pipe_connection_lost(self, fd, exc):
+    if(1 == fd):
+      self._closed = True
+      self._try_finish()
 
   # process exited
   def process_exited(self):
     print(f"CytosimReportProtocol process_exited")
-    if(self._buf is not None):
-      print(f"CytosimReportProtocol process_exited: buffer = '{self._buf}'")
-    with open(os.path.join(self._simdir, self._fname), 'wb') as handle:
-      pickle.dump(self._simdir, handle, protocol=pickle.HIGHEST_PROTOCOL)
-      pickle.dump(self._data,   handle, protocol=pickle.HIGHEST_PROTOCOL)
-    self._done_future.set_result(self._data)
+    self._exited = True
+    self._try_finish()
+
+  # finish once the process exited, its output was read and the pool is done
+  def _try_finish(self):
+    if(not self._exited)or(not self._closed)or(self._failed):
+      return
+    try:
+      if(len(self._buf)):
+        print(f"CytosimReportProtocol process_exited: unterminated output = " + bytes(self._buf).decode('ascii', 'replace'))
+        self._buf = bytearray()
+      if(self._frm_idx is not None):
+        # keep the data of an unfinished frame
+        self._end_frame()
+        self._frm_idx = None
+      if(len(self._pending)):
+        print(f"CytosimReportProtocol process_exited: waiting for {len(self._pending)} frame(s) in the pool")
+        return
+      if(not self._done_future.done()):
+        self._finish()
+    except Exception as e:
+      self._fail(e)
+
+  # write out the results
+  def _finish(self):
+    if(self._summary is not None)and(self._save):
+      summary.save(summary.filename(os.path.join(self._simdir, self._fname)), self._simdir, self._summary.build())
+    if(self._queue is not None):
+      self._queue.put_nowait((self._op, None, None))
+      self._done_future.set_result(None)
+      return
+    if(isinstance(self._data, framestore.FrameStreamWriter)):
+      self._data.close()
+      print(f"CytosimReportProtocol process_exited: {len(self._data)} frame(s) written to {self._data.filepath}")
+      self._done_future.set_result(self._data.filepath)
+      return
+    table = self._data.build()
+    if(self._save):
+      framestore.save(os.path.join(self._simdir, self._fname), self._simdir, table)
+    self._done_future.set_result(table)
 
 # Report Subprocess Factory
 class CytosimReportSubprocessFactory:
   """
   Cytosim Subprocess Factory
   """
-  def __init__(self, future, op, simdir, frames, out):
+  def __init__(self, future, op, simdir, frames, out, **options):
     self._cmd_report = os.path.expandvars('${CYTOSIMBINPATH}/report')
     if os.path.isfile(self._cmd_report) and os.access(self._cmd_report, os.X_OK):
       pass
@@ -222,14 +628,12 @@ class CytosimReportSubprocessFactory:
     self._simdir = simdir
     self._frames = frames
     self._out = out
+    self._options = options
     pass
 
   def protocol(self):
-    fname = CytosimReportSubprocessFactory.filename(self._op, self._frames)
-    if(self._out is not None):
-      fname = self._out + '_' + fname
-
-    return CytosimReportProtocol(self._future, self._op, self._simdir, fname)
+    fname = CytosimReportSubprocessFactory.output(self._op, self._frames, self._out)
+    return CytosimReportProtocol(self._future, self._op, self._simdir, fname, **self._options)
 
   def args(self):
     cmd = [self._cmd_report, opts_dict[self._op]]
@@ -245,6 +649,13 @@ class CytosimReportSubprocessFactory:
     print(f"cwd = {self._simdir}")
     return { 'cwd' : self._simdir }
 
+  @staticmethod
+  def output(op, frames, out):
+    fname = CytosimReportSubprocessFactory.filename(op, frames)
+    if(out is not None):
+      fname = out + '_' + fname
+    return fname
+
   @staticmethod
   def filename(op, frames):
     suffix = None
@@ -336,17 +747,37 @@ class CytosimPlaySubprocessFactory:
 # Common
 ###
 
-@asyncio.coroutine
-def _run_jobs(loop, args):
-  done, pending = None, None
-  done_future = None
+def shard_frames(frames, shards):
+  """
+  Split a list of frames into (at most) a given number of contiguous ranges
+  """
+  if(frames is None)or(shards is None)or(shards <= 1):
+    return [frames]
+  if(not isinstance(frames, list)):
+    frames = [frames]
+  shards = min(shards, len(frames))
+  bounds = [ (len(frames) * i) // shards for i in range(shards + 1) ]
+  return [ frames[bounds[i]:bounds[i+1]] for i in range(shards) ]
 
+async def _run_jobs(loop, args):
   done_futures = dict()
   transports = []
   results = dict()
+  pool = None
+  error = None
 
   simdir = args['simdir']
   frames = args['frames'] if 'frames' in args.keys() else None
+  # batch mode: one slot per process, released when the process is done
+  semaphore = args.get('semaphore', None)
+
+  async def acquire_slot():
+    if(semaphore is not None):
+      await semaphore.acquire()
+
+  def release_slot(future):
+    if(semaphore is not None):
+      future.add_done_callback(lambda f: semaphore.release())
 
   try:
     # timing
@@ -354,25 +785,56 @@ def _run_jobs(loop, args):
     # run the process
     if(args['kind'] == 'report'):
       out = args['out'] if 'out' in args.keys() else None
+      options = { k : args[k] for k in ['vectorized', 'stream', 'max_pending', 'save', 'verbose', 'reducers'] if k in args.keys() }
+      if(args.get('pool', None) is not None):
+        options['pool'] = args['pool']
+      elif(args.get('workers', 0) > 0):
+        # parse the frames of all operations on a shared process pool
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=args['workers'])
+        options['pool'] = pool
+      if(frames is None)and(args.get('shards', 1) > 1)and(os.path.isfile(os.path.join(simdir, 'objects.cmo'))):
+        # the frame count of the trajectory is needed to shard 'all' frames
+        frames = list(range(len(cmoreader.frame_index(os.path.join(simdir, 'objects.cmo'))['offsets'])))
+      shards = shard_frames(frames, args.get('shards', 1))
+      if(len(shards) > 1)and(options.get('stream', False)):
+        print('sharding is not available in the streaming mode')
+        shards = [frames]
+      if(len(shards) > 1):
+        options['save'] = False
       for op in args['ops']:
         results[op] = None
-        done_futures[op] = asyncio.Future(loop = loop)
-        factory = CytosimReportSubprocessFactory(done_futures[op], op, simdir, frames, out)
+        for ishard, shard in enumerate(shards):
+          done_futures[(op, ishard)] = loop.create_future()
+          await acquire_slot()
+          release_slot(done_futures[(op, ishard)])
+          factory = CytosimReportSubprocessFactory(done_futures[(op, ishard)], op, simdir, shard, out, **options)
 
-        transport, protocol = yield from loop.subprocess_exec(
-          factory.protocol,
-          *factory.args(),
-          **factory.kwargs()
-        )
+          transport, protocol = await loop.subprocess_exec(
+            factory.protocol,
+            *factory.args(),
+            **factory.kwargs()
+          )
 
-        transports.append(transport)
+          transports.append(transport)
+          args['processes'] = args.get('processes', 0) + 1
+    elif(args['kind'] == 'cmo'):
+      # read objects.cmo directly, off the event loop
+      out = args['out'] if 'out' in args.keys() else None
+      cmo_ops = [ op for op in args['ops'] if opts_dict[op] in cmoreader.cmo_ops ]
+      for op in args['ops']:
+        results[op] = None
+        if(op not in cmo_ops):
+          print(f'operation "{opts_dict[op]}" is not available from objects.cmo, use the report backend')
+      await acquire_slot()
+      done_futures['cmo'] = loop.run_in_executor(None, cmoreader.read_report, simdir, [ opts_dict[op] for op in cmo_ops ], frames)
+      release_slot(done_futures['cmo'])
     elif(args['kind'] == 'play'):
       for ch, tdir in zip(args['channels'],args['tmpdirs']):
         results[ch] = None
-        done_futures[ch] = asyncio.Future(loop = loop)
+        done_futures[ch] = loop.create_future()
         factory = CytosimPlaySubprocessFactory(done_futures[ch], ch, simdir, frames, tdir)
 
-        transport, protocol = yield from loop.subprocess_exec(
+        transport, protocol = await loop.subprocess_exec(
           factory.protocol,
           *factory.args(),
           **factory.kwargs()
@@ -382,18 +844,31 @@ def _run_jobs(loop, args):
     else:
       raise RuntimeError('unknown argument kind "' + args['kind'] + '"')
 
-    done, pending = yield from asyncio.wait(done_futures.values(), loop=loop, return_when=asyncio.ALL_COMPLETED)
+    await asyncio.wait(done_futures.values(), return_when=asyncio.ALL_COMPLETED)
 
-    #done_future = done.pop()
     if(args['kind'] == 'report'):
       for op in args['ops']:
-        results[op] = done_futures[op].result()
+        if(len(shards) > 1):
+          # merge the shards in frame order
+          results[op] = framestore.FrameTable.concat([ done_futures[(op, ishard)].result() for ishard in range(len(shards)) ])
+          if(args.get('save', True)):
+            framestore.save(os.path.join(simdir, CytosimReportSubprocessFactory.output(op, frames, out)), simdir, results[op])
+            summary.write(os.path.join(simdir, CytosimReportSubprocessFactory.output(op, frames, out)), simdir, results[op], args.get('reducers', None))
+        else:
+          results[op] = done_futures[(op, 0)].result()
+    elif(args['kind'] == 'cmo'):
+      tables = done_futures['cmo'].result()
+      for op in cmo_ops:
+        results[op] = tables[opts_dict[op]]
+        if(args.get('save', True)):
+          framestore.save(os.path.join(simdir, CytosimReportSubprocessFactory.output(op, frames, out)), simdir, results[op])
+          summary.write(os.path.join(simdir, CytosimReportSubprocessFactory.output(op, frames, out)), simdir, results[op], args.get('reducers', None))
     elif(args['kind'] == 'play'):
       for ch in args['channels']:
         results[ch] = done_futures[ch].result()
 
-    #yield from done_future
   except Exception as e:
+    error = e
     #print(f'could not start process: {e}')
     print("Exception occured when starting a cytosim process:")
     print('BEGIN' + '-'*60)
@@ -401,14 +876,21 @@ def _run_jobs(loop, args):
     traceback.print_exc(file=sys.stdout)
     print('END  ' + '-'*60)
   finally:
-    if pending is not None:
-      for future in pending: future.cancel()
+    # also the futures of the processes that never started, this releases their slots
+    for future in done_futures.values():
+      if(not future.done()): future.cancel()
+
+    # the other failed operations (or shards), only the first error was raised
+    for key, future in done_futures.items():
+      if(future.cancelled())or(future.exception() is None)or(future.exception() is error):
+        continue
+      print(f'{key} failed: {future.exception()!r}')
 
     for transport in transports:
       if transport: transport.close()
 
-    #if done_future is not None:
-    #  return done_future.result()
+    if pool is not None:
+      pool.shutdown()
 
     # timing
     time_stop = time.time()
@@ -431,3 +913,229 @@ def run_cytosim_async_loop(args):
     return loop.run_until_complete(_run_jobs(loop,args)) # run all jobs
   finally:
     loop.close()
+
+async def _run_batch(loop, jobs, max_concurrent):
+  # bounds the processes, not the jobs: a sharded job starts several processes
+  semaphore = asyncio.Semaphore(max_concurrent)
+  for job in jobs:
+    job['semaphore'] = semaphore
+
+  return await asyncio.gather(*[ _run_jobs(loop, args) for args in jobs ])
+
+def run_cytosim_batch_async_loop(batch, max_concurrent=None):
+  """
+  Run the report jobs of several simulations in a single event loop
+    batch          : list of 'report' job arguments (see _run_jobs)
+    max_concurrent : maximal number of concurrent report processes, defaults to the number of cores
+  returns the list of results of every job in batch
+  """
+  if(max_concurrent is None):
+    max_concurrent = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+  # one job per simulation: its report processes take a slot each, objects.cmo is read once
+  jobs = []
+  for args in batch:
+    if(args['kind'] not in ['report', 'cmo']):
+      raise RuntimeError('batch mode supports only "report" and "cmo" jobs')
+    jobs.append(dict(args))
+
+  # a single worker pool shared by all jobs
+  pool = None
+  workers = max([ args.get('workers', 0) for args in batch ] + [0])
+  if(workers > 0):
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    for job in jobs:
+      job['pool'] = pool
+
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop) # bind event loop to current thread
+
+  time_start = time.time()
+  try:
+    results = loop.run_until_complete(_run_batch(loop, jobs, max_concurrent)) # run all jobs
+  finally:
+    loop.close()
+    if pool is not None:
+      pool.shutdown()
+  time_stop = time.time()
+
+  # the results of every operation of every simulation
+  num_ops = 0
+  num_frames = 0
+  num_failed = 0
+  for job, res in zip(jobs, results):
+    for op in job['ops']:
+      num_ops += 1
+      if(res.get(op, None) is None):
+        num_failed += 1
+      elif(isinstance(res[op], framestore.FrameTable)):
+        num_frames += len(res[op])
+      elif(job['frames'] is not None):
+        num_frames += len(job['frames'])
+  num_processes = sum( job.get('processes', 0) for job in jobs )
+
+  elapsed = time_stop - time_start
+  print(f"batch: {len(batch)} simulation(s), {num_ops} operation(s) ({num_failed} failed), {num_processes} report process(es), "
+        f"{num_frames} frame(s) in {elapsed:.2f} seconds with up to {max_concurrent} concurrent process(es)")
+  if(elapsed > 0):
+    print(f"batch: throughput {num_frames/elapsed:.1f} frame(s)/s, {num_processes/elapsed:.2f} process(es)/s", flush=True)
+  return results
+
+###
+# Frame streaming
+###
+
+async def stream_report(simdir, ops, frames=None, workers=0, max_queued=16, **options):
+  """
+  Yield the frames of 'report' operations as soon as they are parsed
+    simdir     : simulation directory
+    ops        : list of operations (see opts_dict)
+    frames     : list of frame indexes, defaults to all frames
+    workers    : number of processes decoding the frame blocks (0: decode on the event loop)
+    max_queued : number of parsed frames waiting for the consumer before 'report' is paused
+  yields (op, frame index, dict of column arrays); the frames of one operation
+  come in order, the frames of different operations are interleaved
+
+  Nothing is written to disk and no frame is kept once it was yielded. If an
+  operation fails (e.g. its output cannot be parsed), its error is raised
+  here and the other processes are stopped.
+  """
+  loop = asyncio.get_running_loop()
+  queue = asyncio.Queue()
+  pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+  transports = []
+  protocols = []
+  done_futures = []
+  try:
+    for op in ops:
+      done_futures.append(loop.create_future())
+      factory = CytosimReportSubprocessFactory(done_futures[-1], op, simdir, frames, None, pool=pool,
+                                               save=False, queue=queue, max_queued=max_queued, **options)
+      transport, protocol = await loop.subprocess_exec(
+        factory.protocol,
+        *factory.args(),
+        **factory.kwargs()
+      )
+      transports.append(transport)
+      protocols.append(protocol)
+
+    running = len(ops)
+    while(running > 0):
+      op, frm, cols = await queue.get()
+      for protocol in protocols:
+        protocol.frame_consumed()
+      if(frm is None):
+        if(cols is not None):
+          raise cols
+        running -= 1
+        continue
+      yield op, frm, cols
+  finally:
+    # stops the processes that are still running (e.g. the consumer stopped early or an operation failed)
+    for transport in transports:
+      transport.close()
+    if(len(transports)):
+      await asyncio.wait(done_futures[:len(transports)])
+      # the errors were raised from the queue already
+      for future in done_futures[:len(transports)]:
+        if(not future.cancelled()):
+          future.exception()
+    if pool is not None:
+      pool.shutdown()
+
+def iter_report(simdir, ops, frames=None, **options):
+  """
+  Synchronous iterator over stream_report, running its own event loop
+  """
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop) # bind event loop to current thread
+  frames_iter = stream_report(simdir, ops, frames, **options)
+  try:
+    while True:
+      try:
+        item = loop.run_until_complete(frames_iter.__anext__())
+      except StopAsyncIteration:
+        break
+      yield item
+  finally:
+    loop.run_until_complete(frames_iter.aclose())
+    loop.close()
+
+# images written by 'play' (image_format=png)
+re_play_image = re.compile(r'^image(\d+)\.png$')
+
+def play_images(tdir):
+  """Sorted frame indexes and paths of the images in a 'play' output directory"""
+  images = []
+  for name in os.listdir(tdir):
+    match = re_play_image.match(name)
+    if(match is not None):
+      images.append((int(match.group(1)), os.path.join(tdir, name)))
+  return sorted(images)
+
+async def stream_play(simdir, channels, tmpdirs, frames=None, poll=0.05):
+  """
+  Yield the images of 'play' processes as soon as they are complete
+    simdir   : simulation directory
+    channels : list of channels, one 'play' process each
+    tmpdirs  : output directory of every channel (with its properties.cmo)
+    frames   : list of frame indexes, defaults to all frames
+    poll     : interval in seconds between two scans of the output directories
+  yields (channel, frame index, path to the PNG file)
+
+  'play' writes the frames in order, so an image is complete once the next one
+  appeared or the process exited. The consumer owns the yielded files.
+  """
+  loop = asyncio.get_running_loop()
+  transports = []
+  done_futures = []
+  seen = [ set() for ch in channels ]
+  try:
+    for ch, tdir in zip(channels, tmpdirs):
+      done_futures.append(loop.create_future())
+      factory = CytosimPlaySubprocessFactory(done_futures[-1], ch, simdir, frames, tdir)
+      transport, protocol = await loop.subprocess_exec(
+        factory.protocol,
+        *factory.args(),
+        **factory.kwargs()
+      )
+      transports.append(transport)
+
+    running = True
+    while(running):
+      running = False
+      for ich, (ch, tdir) in enumerate(zip(channels, tmpdirs)):
+        # check the process before listing, all images are complete once it exited
+        exited = done_futures[ich].done()
+        images = [ img for img in play_images(tdir) if img[0] not in seen[ich] ]
+        if(not exited):
+          images = images[:-1]
+          running = True
+        for frm, path in images:
+          seen[ich].add(frm)
+          yield ch, frm, path
+      if(running):
+        await asyncio.sleep(poll)
+  finally:
+    for transport in transports:
+      transport.close()
+    if(len(transports)):
+      await asyncio.wait(done_futures[:len(transports)])
+
+def iter_play(simdir, channels, tmpdirs, frames=None, **options):
+  """
+  Synchronous iterator over stream_play, running its own event loop
+  """
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop) # bind event loop to current thread
+  images_iter = stream_play(simdir, channels, tmpdirs, frames, **options)
+  try:
+    while True:
+      try:
+        item = loop.run_until_complete(images_iter.__anext__())
+      except StopAsyncIteration:
+        break
+      yield item
+  finally:
+    loop.run_until_complete(images_iter.aclose())
+    loop.close()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+import pickle
+
+import numpy as np
+
+###
+# Columnar frame storage
+###
+
+# format tag of the serialized tables
+FORMAT_COLUMNAR = 'columnar'
+FORMAT_STREAM = 'stream'
+
+class FrameTable:
+  """
+  Columnar (struct-of-arrays) storage of per-frame report results
+    op      : report operation (e.g. 'fiber:position')
+    frames  : frame indexes, shape (n_frames,)
+    offsets : first row of every frame, shape (n_frames+1,)
+    columns : dict of arrays with one row per object (fiber, cluster, ...)
+    ragged  : dict of variable-length member lists stored in CSR layout,
+              name -> { 'size' : column with the row lengths, 'offsets' : (n_rows+1,), 'values' : flat array }
+
+  Rows of frame frames[i] are offsets[i]:offsets[i+1]; frame accessors return
+  views into the flat arrays, no data is copied.
+  """
+  def __init__(self, op, frames, offsets, columns, ragged=None):
+    self.op = op
+    self.frames = np.asarray(frames, dtype=np.int64)
+    self.offsets = np.asarray(offsets, dtype=np.int64)
+    self.columns = columns
+    self.ragged = ragged if ragged is not None else dict()
+    if(len(self.offsets) != len(self.frames) + 1):
+      raise RuntimeError('invalid frame offsets')
+    self._index = { frm : i for i, frm in enumerate(self.frames.tolist()) }
+
+  #
+  # dict-like access by frame index
+  #
+
+  def __len__(self):
+    return len(self.frames)
+
+  def __contains__(self, frm):
+    return frm in self._index
+
+  def __iter__(self):
+    return iter(self.frames.tolist())
+
+  def __getitem__(self, frm):
+    return self.frame(frm)
+
+  def keys(self):
+    return self.frames.tolist()
+
+  def values(self):
+    for frm in self.frames.tolist():
+      yield self.frame(frm)
+
+  def items(self):
+    for frm in self.frames.tolist():
+      yield frm, self.frame(frm)
+
+  def __eq__(self, other):
+    if(not isinstance(other, FrameTable)):
+      return NotImplemented
+    if(self.op != other.op)or(not np.array_equal(self.frames, other.frames))or(not np.array_equal(self.offsets, other.offsets)):
+      return False
+    if(self.columns.keys() != other.columns.keys())or(self.ragged.keys() != other.ragged.keys()):
+      return False
+    for name, col in self.columns.items():
+      if(not np.array_equal(col, other.columns[name])):
+        return False
+    for name, rgd in self.ragged.items():
+      if(not np.array_equal(rgd['values'], other.ragged[name]['values'])):
+        return False
+    return True
+
+  #
+  # frame views
+  #
+
+  def rows(self, frm):
+    """Row slice of a given frame"""
+    i = self._index[frm]
+    return slice(self.offsets[i], self.offsets[i+1])
+
+  def frame(self, frm):
+    """Dict of per-frame views of every column"""
+    rows = self.rows(frm)
+    view = { name : col[rows] for name, col in self.columns.items() }
+    for name, rgd in self.ragged.items():
+      view[name] = rgd['values'][rgd['offsets'][rows.start]:rgd['offsets'][rows.stop]]
+    return view
+
+  def counts(self):
+    """Number of rows in every frame"""
+    return np.diff(self.offsets)
+
+  def row_frames(self):
+    """Position of the frame (in self.frames) of every row"""
+    return np.repeat(np.arange(len(self.frames)), self.counts())
+
+  @property
+  def nbytes(self):
+    nbytes = self.frames.nbytes + self.offsets.nbytes
+    nbytes += sum(col.nbytes for col in self.columns.values())
+    nbytes += sum(rgd['offsets'].nbytes + rgd['values'].nbytes for rgd in self.ragged.values())
+    return nbytes
+
+  #
+  # serialization
+  #
+
+  def state(self):
+    """Plain dict of arrays, can be unpickled without this module"""
+    return { 'format' : FORMAT_COLUMNAR, 'op' : self.op, 'frames' : self.frames, 'offsets' : self.offsets,
+             'columns' : self.columns, 'ragged' : self.ragged }
+
+  @staticmethod
+  def from_state(state):
+    if(not is_columnar(state)):
+      raise RuntimeError('not a columnar frame table')
+    return FrameTable(state['op'], state['frames'], state['offsets'], state['columns'], state['ragged'])
+
+  def select(self, frames):
+    """New table with the given frames, in the given order"""
+    builder = FrameTableBuilder(self.op, { name : rgd['size'] for name, rgd in self.ragged.items() })
+    for frm in frames:
+      builder.append(frm, self.frame(frm))
+    return builder.build()
+
+  @staticmethod
+  def concat(tables):
+    """Concatenate tables of the same operation, keeping the frame order of the arguments"""
+    builder = None
+    for table in tables:
+      if(builder is None):
+        builder = FrameTableBuilder(table.op, { name : rgd['size'] for name, rgd in table.ragged.items() })
+      for frm, cols in table.items():
+        builder.append(frm, cols)
+    if(builder is None):
+      raise RuntimeError('nothing to concatenate')
+    return builder.build()
+
+def is_columnar(state):
+  return isinstance(state, dict) and (state.get('format', None) == FORMAT_COLUMNAR)
+
+class FrameTableBuilder:
+  """
+  Accumulate per-frame column dicts and build a FrameTable
+    op     : report operation
+    ragged : dict of variable-length columns, name -> name of the column with the row lengths
+  """
+  def __init__(self, op, ragged=None):
+    self._op = op
+    self._ragged = ragged if ragged is not None else dict()
+    self._frames = []
+    self._counts = []
+    self._columns = dict()
+
+  def __len__(self):
+    return len(self._frames)
+
+  def append(self, frm, cols):
+    count = None
+    for name, col in cols.items():
+      if(name in self._ragged):
+        continue
+      if(count is None):
+        count = len(col)
+      elif(count != len(col)):
+        raise RuntimeError(f'frame {frm}: column "{name}" has {len(col)} rows, expected {count}')
+    for name, col in cols.items():
+      self._columns.setdefault(name, []).append(np.asarray(col))
+    self._frames.append(frm)
+    self._counts.append(count if count is not None else 0)
+
+  def build(self):
+    offsets = np.zeros(len(self._counts) + 1, dtype=np.int64)
+    np.cumsum(self._counts, out=offsets[1:])
+    columns = dict()
+    ragged = dict()
+    for name, parts in self._columns.items():
+      values = np.concatenate(parts) if len(parts) else np.zeros(0)
+      if(name in self._ragged):
+        ragged[name] = { 'size' : self._ragged[name], 'values' : values }
+      else:
+        columns[name] = values
+    for name, rgd in ragged.items():
+      rgd['offsets'] = np.zeros(offsets[-1] + 1, dtype=np.int64)
+      np.cumsum(columns[rgd['size']], out=rgd['offsets'][1:])
+    return FrameTable(self._op, self._frames, offsets, columns, ragged)
+
+###
+# Append-only frame stream
+###
+
+class FrameStreamWriter:
+  """
+  Append-only on-disk frame store, written one frame at a time
+    filepath : output file path
+    simdir   : simulation directory (first record, as in the regular report pickles)
+    op       : report operation
+    ragged   : dict of variable-length columns, name -> name of the column with the row lengths
+
+  The file is a sequence of pickle records: simdir, a header and one
+  (frame, columns) record per frame. Every record is flushed to disk as soon as
+  it is written, so an interrupted run leaves all completed frames readable.
+  """
+  def __init__(self, filepath, simdir, op, ragged=None):
+    self._filepath = filepath
+    self._handle = open(filepath, 'wb')
+    self._count = 0
+    self._write(simdir)
+    self._write({ 'format' : FORMAT_STREAM, 'op' : op, 'ragged' : ragged if ragged is not None else dict() })
+
+  def __len__(self):
+    return self._count
+
+  @property
+  def filepath(self):
+    return self._filepath
+
+  def _write(self, obj):
+    pickle.dump(obj, self._handle, protocol=pickle.HIGHEST_PROTOCOL)
+    self._handle.flush()
+
+  def append(self, frm, cols):
+    self._write((frm, cols))
+    self._count += 1
+
+  def close(self):
+    if(self._handle is not None):
+      self._handle.close()
+      self._handle = None
+
+def iter_stream(handle, header):
+  """
+  Iterate over the (frame, columns) records of a frame stream, stopping
+  quietly at a truncated last record
+  """
+  while True:
+    try:
+      yield pickle.load(handle)
+    except EOFError:
+      return
+    except (pickle.UnpicklingError, ValueError, TypeError, AttributeError, IndexError):
+      print(f'frame stream of "{header["op"]}" is truncated')
+      return
+
+def is_stream(header):
+  return isinstance(header, dict) and (header.get('format', None) == FORMAT_STREAM)
+
+def save(filepath, simdir, table):
+  """
+  Write a report result file: the simulation directory followed by the columnar table
+  """
+  with open(filepath, 'wb') as handle:
+    pickle.dump(simdir,        handle, protocol=pickle.HIGHEST_PROTOCOL)
+    pickle.dump(table.state(), handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load(filepath):
+  """
+  Read a report result file (columnar pickle or frame stream)
+  returns the simulation directory and a FrameTable
+  """
+  with open(filepath, 'rb') as handle:
+    simdir = pickle.load(handle)
+    data = pickle.load(handle)
+    if(is_columnar(data)):
+      return simdir, FrameTable.from_state(data)
+    if(is_stream(data)):
+      builder = FrameTableBuilder(data['op'], data['ragged'])
+      for frm, cols in iter_stream(handle, data):
+        builder.append(frm, cols)
+      return simdir, builder.build()
+  raise RuntimeError(f'"{filepath}" is not a columnar report result')
@@ -13,16 +13,121 @@ import os
 
 import click
 
+import cmoreader
 import cytosim
+import framestore
+import resultcache
+import summary
+
+def simulation_frames(simdir : str, frame_step : int):
+  """Frames 0, frame_step, ... up to the total 'nb_frames' of the model file (as in run_analysis.sh)"""
+  case_id = os.path.basename(os.path.dirname(os.path.abspath(simdir)))
+  cym = os.path.join(simdir, f'{case_id}.cym')
+  if(not os.path.isfile(cym)):
+    click.echo(f'Warning: Cytosim model file ({case_id}.cym) not found in {simdir}')
+    return None
+  num_frames = 0
+  with open(cym, 'r') as handle:
+    for line in handle:
+      if('nb_frames' in line):
+        num_frames += int(''.join(c for c in line if c.isdigit()))
+  return list(range(0, num_frames + 1, frame_step))
+
+def job_kind(simdir : str, kind : str):
+  """Backend of a simulation: the cmo backend falls back to report unless objects.cmo is a text trajectory"""
+  if(kind == 'cmo'):
+    filepath = os.path.join(simdir, 'objects.cmo')
+    if(not os.path.isfile(filepath)):
+      click.echo(f'No objects.cmo in {simdir}, using the report backend')
+      return 'report'
+    if(not cmoreader.is_text(filepath)):
+      click.echo(f'{filepath} is a binary trajectory, using the report backend')
+      return 'report'
+  return kind
+
+def make_job(simdir : str, out : str, ops : list, frames_idx : list, options : dict, kind : str ='report'):
+  """Report job for one simulation, skipping the operations with existing results"""
+  if(not os.path.isdir(simdir)):
+    click.echo(f'Invalid simulation path: {simdir} is not a directory')
+    return None
+
+  ops = list(ops)
+  for o in list(ops):
+    fname = os.path.join(simdir, cytosim.CytosimReportSubprocessFactory.output(o, frames_idx, out))
+    if os.path.isfile(fname):
+      click.echo(f'Found file {fname}, cancelling \'{o}\'')
+      ops.remove(o)
+    else:
+      click.echo(f'Did not find file {fname}')
+
+  if(len(ops) == 0):
+    click.echo(f'Nothing to be done for {simdir}')
+    return None
+
+  args = { 'kind' : job_kind(simdir, kind), 'simdir' : simdir, 'ops' : ops, 'frames' : frames_idx, 'out' : out }
+  args.update(options)
+  return args
+
+def make_cached_jobs(work : list, ops : list, options : dict, kind : str ='report'):
+  """
+  Report jobs for the frames missing from the result caches
+  returns the jobs and a list of (cache entry, job index or None)
+  """
+  batch = []
+  cached = []
+  for d, d_out, d_frames in work:
+    if(not os.path.isdir(d)):
+      click.echo(f'Invalid simulation path: {d} is not a directory')
+      continue
+    if(not resultcache.ResultCache.available(d)):
+      click.echo(f'No objects.cmo in {d}, the result cache is not used')
+      args = make_job(d, d_out, ops, d_frames, options, kind)
+      if(args is not None):
+        batch.append(args)
+      continue
+    # one job per simulation, over the frames missing for any of its operations
+    job_ops = []
+    job_frames = set()
+    for o in ops:
+      res_cache = resultcache.ResultCache(d, cytosim.opts_dict[o])
+      missing = res_cache.missing(d_frames)
+      if(len(missing) == 0):
+        click.echo(f'Found all frames of \'{o}\' in the cache of {d}')
+        cached.append(((res_cache, d, d_out, d_frames, o), None))
+        continue
+      click.echo(f'Computing {len(missing)} frame(s) of \'{o}\' missing from the cache of {d}')
+      cached.append(((res_cache, d, d_out, d_frames, o), len(batch)))
+      job_ops.append(o)
+      job_frames.update(missing)
+    if(len(job_ops)):
+      args = { 'kind' : job_kind(d, kind), 'simdir' : d, 'ops' : job_ops, 'frames' : sorted(job_frames), 'out' : d_out, 'save' : False }
+      args.update(options)
+      batch.append(args)
+  return batch, cached
 
 @click.command()
-@click.option("--simdir", default=None, help="The directory with cytosim simulation data.")
-@click.option("--out", default=None, help="Output file name")
+@click.option("--simdir", default=None, multiple=True, help="The directory with cytosim simulation data (can be repeated).")
+@click.option("--logs", default=None, multiple=True, help="A log file listing simulation directories, one per line (can be repeated).")
+@click.option("--out", default=None, help="Output file name (single --simdir only; the simulations of --logs are written as CASE_SIM_..., as in run_analysis.sh)")
 @click.option("--op", help="A comma-separated list of operations to perform: " + ", ".join(cytosim.opts_dict.keys()))
 @click.option("--frames", default='all', type=str,
               help="A comma-separated list of frames which to dump. "
                    "Defaults to 'all'")
-def main(simdir : str, out : str, op : str, frames : str ='all'):
+@click.option("--frame-step", default=0, help="Dump every n-th frame of each simulation, based on its model file (overrides --frames)")
+@click.option("--backend", default='report', type=click.Choice(['report', 'cmo']), help="Run the 'report' executable or read objects.cmo directly. The 'cmo' backend is experimental (see --experimental-cmo): it reads only text trajectories (binary_output=0) and uses report for the binary objects.cmo cytosim writes by default")
+@click.option("--experimental-cmo", is_flag=True, default=False, help="Allow the experimental 'cmo' backend; check its results against report with benchmark.py cmo-reader first")
+@click.option("--stream", is_flag=True, default=False, help="Write every frame to the output file as soon as it is parsed (bounded memory)")
+@click.option("--workers", default=0, help="Number of worker processes parsing the report output (0: parse on the event loop)")
+@click.option("--shards", default=1, help="Split the frames of every operation into this many contiguous ranges processed by parallel report processes")
+@click.option("--cache/--no-cache", default=False, help="Keep the computed frames in SIMDIR/.pycytosim-cache and reuse them in later runs on the same trajectory (one file per operation)")
+@click.option("--summary/--no-summary", 'summarize', default=True, help="Write per-frame summaries (cluster sizes, fiber lengths, orientation order, single forces) next to the results")
+@click.option("--verbose", default=1, help="Output level: 0 errors only, 1 frame progress, 2 echo the output of report")
+@click.option("--jobs", default=0, help="Maximal number of concurrent report processes in batch mode (0: number of cores)")
+def main(simdir : tuple, logs : tuple, out : str, op : str, frames : str ='all', frame_step : int =0, backend : str ='report', experimental_cmo : bool =False, stream : bool =False, workers : int =0, shards : int =1, cache : bool =False, summarize : bool =True, verbose : int =1, jobs : int =0):
+  if(backend == 'cmo')and(not experimental_cmo):
+    click.echo(f'The cmo backend is experimental: pass --experimental-cmo to use it')
+    return
+
   # frame indexes
   frames_idx = None
   if('all' != frames):
@@ -36,8 +141,17 @@ def main(simdir : str, out : str, op : str, frames : str ='all'):
       click.echo(f'Invalid frame index: {str_frm} is cannot be converted to an integer')
       return
 
-  if(not os.path.isdir(simdir)):
-    click.echo(f'Invalid simulation path: {simdir} is not a directory')
+  # simulation directories
+  simdirs = list(simdir)
+  for log in logs:
+    if(not os.path.isfile(log)):
+      click.echo(f'Invalid log file: {log} is not a file')
+      return
+    with open(log, 'r') as handle:
+      simdirs.extend(line.strip() for line in handle if len(line.strip()))
+
+  if(len(simdirs) == 0):
+    click.echo(f'Invalid simulation path: no simulation directory was provided')
     return
 
   ops = []
@@ -53,19 +167,54 @@ def main(simdir : str, out : str, op : str, frames : str ='all'):
     if(not valid):
       click.echo(f'Invalid operation: "{o}" is not recognized')
 
-  for o in ops:
-    fname = os.path.join(simdir, cytosim.CytosimReportSubprocessFactory.filename(o, frames_idx))
-    if os.path.isfile(fname):
-      click.echo(f'Found file {fname}, cancelling \'{o}\'')
-      ops.remove(o)
-    else:
-      click.echo(f'Did not find file {fname}')
+  options = { 'stream' : stream, 'workers' : workers, 'shards' : shards, 'verbose' : verbose,
+              'reducers' : summary.builtin_reducers() if summarize else None }
 
-  if(len(ops)):
-    args = { 'kind' : 'report', 'simdir' : simdir, 'ops' : ops, 'frames' : frames_idx, 'out' : out }
-    cytosim.run_cytosim_async_loop(args)
+  # simulations to process: directory, output prefix and frames
+  work = []
+  if(len(simdirs) == 1)and(len(logs) == 0):
+    d_frames = simulation_frames(simdirs[0], frame_step) if frame_step > 0 else frames_idx
+    work.append((simdirs[0], out, d_frames))
   else:
+    # batch mode (several directories or log files): output named as in run_analysis.sh
+    for d in simdirs:
+      d = d.rstrip(os.sep)
+      d_frames = simulation_frames(d, frame_step) if frame_step > 0 else frames_idx
+      if(frame_step > 0)and(d_frames is None):
+        continue
+      d_out = os.path.join(d, os.path.basename(os.path.dirname(os.path.abspath(d))) + '_' + os.path.basename(d))
+      work.append((d, d_out, d_frames))
+
+  cached = []
+  if(cache)and(not stream):
+    batch, cached = make_cached_jobs(work, ops, options, backend)
+  else:
+    batch = [ make_job(d, d_out, ops, d_frames, options, backend) for d, d_out, d_frames in work ]
+    batch = [ args for args in batch if args is not None ]
+
+  results = []
+  if(len(batch) == 1):
+    results = [ cytosim.run_cytosim_async_loop(batch[0]) ]
+  elif(len(batch) > 1):
+    results = cytosim.run_cytosim_batch_async_loop(batch, jobs if jobs > 0 else None)
+  elif(len(cached) == 0):
     click.echo(f'Nothing to be done')
 
+  # merge the new frames into the caches and write the requested results
+  for entry, ijob in cached:
+    res_cache, d, d_out, d_frames, o = entry
+    if(ijob is not None):
+      table = results[ijob].get(o, None) if ijob < len(results) else None
+      if(isinstance(table, framestore.FrameTable)):
+        res_cache.merge(table)
+      else:
+        click.echo(f'No results for \'{o}\' in {d}')
+    if(res_cache.table is not None):
+      fname = os.path.join(d, cytosim.CytosimReportSubprocessFactory.output(o, d_frames, d_out))
+      table = res_cache.select(d_frames)
+      framestore.save(fname, d, table)
+      summary.write(fname, d, table, options['reducers'])
+      click.echo(f'Wrote {fname}')
+
 if __name__ == "__main__":
   main()
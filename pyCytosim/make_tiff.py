@@ -13,6 +13,8 @@ import os
 
 import errno
 import shutil
+import collections
+import concurrent.futures
 import numpy as np
 import matplotlib.image
 import tifffile
@@ -21,6 +23,8 @@ import tempfile
 import click
 
 import cytosim
+import cmoreader
+import raster
 
 class TemporaryDirectory(object):
   """Context manager for tempfile.mkdtemp() so it's usable with "with" statement."""
@@ -31,6 +35,146 @@ class TemporaryDirectory(object):
   def __exit__(self, exc_type, exc_value, traceback):
     shutil.rmtree(self.name)
 
+def tmpfs_dir():
+  """A memory-backed directory for the temporary images, None if there is none"""
+  for d in ['/dev/shm', os.environ.get('XDG_RUNTIME_DIR', '')]:
+    if(len(d))and(os.path.isdir(d))and(os.access(d, os.W_OK)):
+      return d
+  return None
+
+def read_matplotlib(path):
+  """Lit pixels of the RGB channels of a play image, read with matplotlib"""
+  im = matplotlib.image.imread(path)[:, :, :3]
+  return np.ceil(im) >= 1
+
+def read_pillow(path):
+  """Lit pixels of the RGB channels of a play image, read with Pillow"""
+  import PIL.Image
+  with PIL.Image.open(path) as im:
+    return np.asarray(im.convert('RGB')) > 0
+
+def read_opencv(path):
+  """Lit pixels of the RGB channels of a play image, read with OpenCV"""
+  import cv2
+  # OpenCV stores the channels as BGR(A)
+  return cv2.imread(path, cv2.IMREAD_UNCHANGED)[:, :, 2::-1] > 0
+
+image_readers = { 'matplotlib' : read_matplotlib, 'pillow' : read_pillow, 'opencv' : read_opencv }
+
+# dataset encodings: page data type, byte order and ImageJ hyperstack
+# (ImageJ has no 1-bit images, 'bits' is a plain TIFF with TZCYXS axes)
+encodings = {
+  'uint16' : { 'dtype' : np.uint16, 'byteorder' : '>', 'imagej' : True },
+  'uint8'  : { 'dtype' : np.uint8,  'byteorder' : '=', 'imagej' : True },
+  'bits'   : { 'dtype' : np.bool_,  'byteorder' : '=', 'imagej' : False },
+}
+
+# pure colors of the channels rendered by a single play run
+single_pass_colors = ['0xFF0000FF', '0x00FF00FF', '0x0000FFFF']
+
+def encode_pages(mask, dtype=np.uint16):
+  """Dataset pages of binary masks, lit pixels are 255 (True for bool)"""
+  return mask if dtype == np.bool_ else np.where(mask, 255, 0).astype(dtype)
+
+def decode_page(path, reader=read_matplotlib, remove=True, dtype=np.uint16, components=(0,)):
+  """
+  Binarize a play image into dataset pages
+    path        : path to the PNG file
+    reader      : one of image_readers
+    remove      : delete the PNG file once decoded
+    dtype       : page data type, lit pixels are 255 (True for bool)
+    components  : RGB components to split into pages
+  returns an array of pages, one per component
+  """
+  pages = encode_pages(np.moveaxis(reader(path)[:, :, list(components)], -1, 0), dtype)
+  if(remove):
+    os.remove(path)
+  return pages
+
+def channel_lengths(tmpdirs, frames_idx):
+  """Number of consecutive frames play wrote into every channel directory"""
+  ch_sz = np.zeros(len(tmpdirs), dtype=np.uint16)
+  for ich, tdir in enumerate(tmpdirs):
+    for frm in frames_idx:
+      if(not os.path.isfile(os.path.join(tdir,f"image{frm:04d}.png"))):
+        break
+      ch_sz[ich] += 1
+  return ch_sz
+
+def stack_paths(tmpdirs, frames_idx, ch_sz):
+  """Paths of the play images in page order (TZC), None past the end of a channel"""
+  for ifrm, frm in enumerate(frames_idx[:np.max(ch_sz)]):
+    for ich, tdir in enumerate(tmpdirs):
+      yield os.path.join(tdir,f"image{frm:04d}.png") if ifrm < ch_sz[ich] else None
+
+def play_paths(images, channels, frames_idx):
+  """
+  Paths of the play images in page order (TZC), as play writes them
+    images     : iterator over (channel, frame index, path), e.g. cytosim.iter_play
+    channels   : list of channels
+    frames_idx : frame indexes
+  yields None for the images play did not write
+  """
+  position = { frm : ifrm for ifrm, frm in enumerate(frames_idx) }
+  ready = dict()
+  exhausted = False
+  for ifrm, frm in enumerate(frames_idx):
+    for ich, ch in enumerate(channels):
+      while(not exhausted)and((ifrm, ich) not in ready):
+        try:
+          img_ch, img_frm, path = next(images)
+        except StopIteration:
+          exhausted = True
+          break
+        if(img_frm not in position):
+          click.echo(f"Unexpected image {path} for channel {img_ch}")
+          continue
+        ready[(position[img_frm], channels.index(img_ch))] = path
+      path = ready.pop((ifrm, ich), None)
+      if(path is None):
+        click.echo(f"Failed! Channel {ch} (#{ich}) has no image for frame {frm}")
+      yield path
+
+def decoded_pages(paths, size, reader=read_matplotlib, remove=False, decoders=0, dtype=np.uint16, components=(0,)):
+  """
+  Decode play images into dataset pages on a thread pool, in order
+    paths       : iterator over the PNG paths in image order, None for a blank image
+    size        : image width and height
+    reader      : one of image_readers
+    remove      : delete the PNG files once decoded
+    decoders    : number of threads (0: number of cores)
+    dtype       : page data type
+    components  : RGB components split into pages from every image
+  at most two images per thread are decoded ahead of the consumer
+  """
+  decoders = decoders if decoders > 0 else os.cpu_count()
+  blank = np.zeros((len(components),size,size), dtype=dtype)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=decoders) as pool:
+    pending = collections.deque()
+    for path in paths:
+      pending.append(None if path is None else pool.submit(decode_page, path, reader, remove, dtype, components))
+      if(len(pending) > 2*decoders):
+        future = pending.popleft()
+        yield from blank if future is None else future.result()
+    while(len(pending)):
+      future = pending.popleft()
+      yield from blank if future is None else future.result()
+
+def write_properties(tdir, new_props_cmo, props_channels, displays):
+  """
+  Write the properties.cmo of a play run
+    tdir           : play output directory
+    new_props_cmo  : lines of the simulation properties without display
+    props_channels : line index and kind of every entity
+    displays       : display of the entities, the others are invisible
+  """
+  with open(os.path.join(tdir,f'properties.cmo'),'w') as f:
+    for idx, line in enumerate(new_props_cmo):
+      for ch, val in props_channels.items():
+        if val['idx'] == idx:
+          line += displays.get(ch, ' display = (visible=0;)\n')
+      f.write(line)
+
 @click.command()
 @click.option("--simdir", default=None, help="The directory with cytosim simulation data.")
 @click.option("--channels", default=None, help="A comma-separated list of dataset entities to represnt as different channels in the dataset.")
@@ -39,13 +183,29 @@ class TemporaryDirectory(object):
 @click.option("--frames", default='all', type=str,
               help="A comma-separated list of frames which to dump. "
                    "Defaults to 'all'")
-def main(simdir : str, channels : str, size : int, out : str, frames : str ='all'):
+@click.option("--pipelined", is_flag=True, default=False, help="Decode every image as soon as play wrote it, while the rendering goes on.")
+@click.option("--decoders", default=0, help="Number of image decoding threads, or of rendering processes with --renderer numpy (0: number of cores)")
+@click.option("--decoder", default='matplotlib', type=click.Choice(list(image_readers.keys())), help="Library used to decode the images (pillow and opencv are faster, if installed).")
+@click.option("--encoding", default='uint16', type=click.Choice(list(encodings.keys())), help="Pixel encoding: big-endian uint16 (default), uint8 or 1-bit (not an ImageJ hyperstack).")
+@click.option("--compression", default='none', type=click.Choice(['none', 'deflate', 'zstd', 'packbits']), help="Lossless compression of the pages (zstd and packbits need imagecodecs).")
+@click.option("--single-pass", is_flag=True, default=False, help="Render up to 3 channels in pure red, green and blue with a single play run.")
+@click.option("--renderer", default='play', type=click.Choice(['play', 'numpy']), help="Render the channels with play, or rasterize the fibers of objects.cmo with NumPy (fiber channels and text trajectories written with binary_output=0 only, no display server).")
+@click.option("--extent", default=20.0, help="Width of the field of view in micrometers: drawn by the numpy renderer, and the pixel spacing of the dataset is extent/size.")
+@click.option("--line-width", default=2, help="Fiber line width in pixels (numpy renderer).")
+def main(simdir : str, channels : str, size : int, out : str, frames : str ='all', pipelined : bool =False, decoders : int =0, decoder : str ='matplotlib', encoding : str ='uint16', compression : str ='none', single_pass : bool =False, renderer : str ='play', extent : float =20.0, line_width : int =2):
 
   # check simulation path
   if(simdir is None)or(not os.path.isdir(simdir)):
     click.echo(f'Invalid simulation path: \'{simdir}\' is not a directory')
     return
 
+  # the numpy renderer reads objects.cmo with cmoreader, which decodes only text trajectories
+  if(renderer == 'numpy'):
+    filepath = os.path.join(simdir,'objects.cmo')
+    if(not os.path.isfile(filepath))or(not cmoreader.is_text(filepath)):
+      click.echo(f'Invalid trajectory: the numpy renderer needs a text objects.cmo (binary_output=0) in {simdir}, use --renderer play')
+      return
+
   # frame indexes
   frames_idx = None
   if('all' != frames):
@@ -59,6 +219,10 @@ def main(simdir : str, channels : str, size : int, out : str, frames : str ='all
       click.echo(f'Invalid frame index: {str_frm} is cannot be converted to an integer')
       return
 
+  if(frames_idx is None)and(os.path.isfile(os.path.join(simdir,'objects.cmo'))):
+    # all frames of the trajectory
+    frames_idx = list(range(len(cmoreader.frame_index(os.path.join(simdir,'objects.cmo'))['offsets'])))
+
   if(channels is not None):
     channels = channels.split(',')
 
@@ -118,81 +282,120 @@ def main(simdir : str, channels : str, size : int, out : str, frames : str ='all
         click.echo(f'Channel {CH} was not found in the dataset')
         return
   else:
-    channels = props_channels.keys()
-  
+    channels = list(props_channels.keys())
+
+  if(renderer == 'numpy'):
+    if(not os.path.isfile(os.path.join(simdir,'objects.cmo'))):
+      click.echo(f'Invalid simulation path: {simdir} must contain an "objects.cmo" file')
+      return
+    for CH in channels:
+      if not props_channels[CH]['fiber']:
+        click.echo(f'Channel {CH} is not a fiber, only fibers can be rasterized (use --renderer play)')
+        return
+
+  if(single_pass)and(len(channels) > len(single_pass_colors)):
+    click.echo(f'Too many channels for a single pass: {len(channels)} > {len(single_pass_colors)}')
+    return
+
   tmpdirs = []
-  for CH in channels:
-    tdir = tempfile.mkdtemp(suffix=CH)
+  if(renderer == 'numpy'):
+    # no play run
+    pass
+  elif(single_pass):
+    # one play run, every channel in its own RGB component
+    play_channels = ['+'.join(channels)]
+    components = list(range(len(channels)))
+    tdir = tempfile.mkdtemp(suffix=play_channels[0], dir=tmpfs_dir())
     tmpdirs.append(tdir)
-    isFiber = props_channels[CH]['fiber']
-    with open(os.path.join(tdir,f'properties.cmo'),'w') as f:
-      for idx, line in enumerate(new_props_cmo):
-        for ch, val in props_channels.items():
-          if val['idx'] == idx:
-            if ch == CH:
-              print(f'{ch} is white')
-              line += ' display = (color=white; visible=1;)\n'
-            else:
-              if not isFiber and val['fiber']:
-                print(f'{ch} is black')
-                line += ' display = (color=black; visible=1;)\n'
-              else:
-                print(f'{ch} is invisible')
-                line += ' display = (visible=0;)\n'
-        f.write(line)
+    hands = any(not props_channels[CH]['fiber'] for CH in channels)
+    displays = dict()
+    for ch, val in props_channels.items():
+      if ch in channels:
+        print(f'{ch} is {single_pass_colors[channels.index(ch)]}')
+        displays[ch] = f' display = (color={single_pass_colors[channels.index(ch)]}; visible=1;)\n'
+      elif hands and val['fiber']:
+        print(f'{ch} is black')
+        displays[ch] = ' display = (color=black; visible=1;)\n'
+      else:
+        print(f'{ch} is invisible')
+    write_properties(tdir, new_props_cmo, props_channels, displays)
+  else:
+    # one play run per channel, rendered in white
+    play_channels = channels
+    components = [0]
+    for CH in channels:
+      tdir = tempfile.mkdtemp(suffix=CH, dir=tmpfs_dir())
+      tmpdirs.append(tdir)
+      isFiber = props_channels[CH]['fiber']
+      displays = dict()
+      for ch, val in props_channels.items():
+        if ch == CH:
+          print(f'{ch} is white')
+          displays[ch] = ' display = (color=white; visible=1;)\n'
+        elif not isFiber and val['fiber']:
+          print(f'{ch} is black')
+          displays[ch] = ' display = (color=black; visible=1;)\n'
+        else:
+          print(f'{ch} is invisible')
+      write_properties(tdir, new_props_cmo, props_channels, displays)
 
   if(len(channels)):
-    args = { 'kind' : 'play', 'channels' : channels, 'simdir' : simdir, 'frames' : frames_idx, 'tmpdirs' : tmpdirs }
-    result = cytosim.run_cytosim_async_loop(args)
-
-    print(result)
-
     # ImageJ dataset properties
     slices = 1
-    metadata = {'unit':'micrometer','tinterval':10,'spacing':20/size}
-    ijmetadata = {'images':len(frames_idx)*len(channels),'channels':len(channels),'slices':slices,'mode':'composite',
-                'frames':len(frames_idx),'hyperstack':True,'loop':False}
+    metadata = {'unit':'micrometer','tinterval':10,'spacing':extent/size}
 
-    # Determine dataset size
-    ch_sz = np.zeros(len(channels), dtype=np.uint16)
-    for ich, ch in enumerate(channels):
-      for ifrm, frm in enumerate(frames_idx):
-        click.echo(f"Checking " + os.path.join(tmpdirs[ich],f"image{frm:04d}.png") + f" for position {ifrm}:0:{ich}")
-        ch_sz[ich] = ifrm
-        try:
-          im = matplotlib.image.imread(os.path.join(tmpdirs[ich],f"image{frm:04d}.png"))[:, :, 0]
-        except (IOError, OSError) as e:
-          click.echo(f"Failed! Channel {ch} (#{ich}) is only {ifrm} frames long")
-          break
-    
-    for ich, ch in enumerate(channels):
-      if(ch_sz[ich]==0):
-        click.echo(f"Failed! Channel {ch} (#{ich}) is empty")
-        quit()
+    if(renderer == 'numpy'):
+      # rasterize the fibers, every frame on a worker process
+      click.echo(f"Rasterizing {len(frames_idx)} frames")
+      shape = (len(frames_idx),slices,len(channels),size,size,1)
+      frames_iter = raster.rendered_frames(simdir, frames_idx, channels, size, extent, line_width, decoders)
+      pages = ( page for masks in frames_iter for page in encode_pages(masks, encodings[encoding]['dtype']) )
+    elif(pipelined):
+      # decode every image as soon as play wrote it
+      images = cytosim.iter_play(simdir, play_channels, tmpdirs, frames_idx)
+      shape = (len(frames_idx),slices,len(channels),size,size,1)
+      pages = decoded_pages(play_paths(images, play_channels, frames_idx), size, image_readers[decoder], True, decoders, encodings[encoding]['dtype'], components)
+    else:
+      args = { 'kind' : 'play', 'channels' : play_channels, 'simdir' : simdir, 'frames' : frames_idx, 'tmpdirs' : tmpdirs }
+      result = cytosim.run_cytosim_async_loop(args)
 
-    # Dataset format TZCYX
-    image_stack = np.zeros((np.max(ch_sz),slices,len(channels),size,size,1), dtype=np.uint16)
+      print(result)
 
-    for ich, ch in enumerate(channels):
-      for ifrm, frm in enumerate(frames_idx):
-        if(ifrm >= ch_sz[ich]):
-          break
-        click.echo(f"Loading " + os.path.join(tmpdirs[ich],f"image{frm:04d}.png") + f" into position {ifrm}:0:{ich}")
-        try:
-          im = matplotlib.image.imread(os.path.join(tmpdirs[ich],f"image{frm:04d}.png"))[:, :, 0]
-        except (IOError, OSError) as e:
-          break
-        image_stack[ifrm, 0, ich, :, :, 0] = np.where(np.ceil(im) < 1, 0, 255)
-
-    # save the result
-    tifffile.imsave(
-      out,
-      image_stack,
-      byteorder='>',
-      #append = 'force',
-      imagej = True,
-      metadata = metadata,
-      ijmetadata = ijmetadata)
+      # Determine dataset size
+      ch_sz = channel_lengths(tmpdirs, frames_idx)
+      for ich, ch in enumerate(play_channels):
+        if(ch_sz[ich]==0):
+          click.echo(f"Failed! Channel {ch} (#{ich}) is empty")
+          quit()
+        if(ch_sz[ich] < len(frames_idx)):
+          click.echo(f"Failed! Channel {ch} (#{ich}) is only {ch_sz[ich]} frames long")
+
+      click.echo(f"Loading {int(np.sum(ch_sz))} images with {decoder}")
+      shape = (int(np.max(ch_sz)),slices,len(channels),size,size,1)
+      pages = decoded_pages(stack_paths(tmpdirs, frames_idx, ch_sz), size, image_readers[decoder], False, decoders, encodings[encoding]['dtype'], components)
+
+    # save the result page by page, dataset format TZCYX
+    # (tifffile derives the images, channels, slices and frames of ImageJ from the shape)
+    options = dict()
+    if(compression != 'none'):
+      options['compression'] = compression
+    if(encodings[encoding]['imagej']):
+      metadata.update({'mode':'composite','loop':False})
+    else:
+      metadata['axes'] = 'TZCYXS'
+    try:
+      with tifffile.TiffWriter(out, byteorder=encodings[encoding]['byteorder'], imagej=encodings[encoding]['imagej']) as tif:
+        tif.write(
+          pages,
+          shape = shape,
+          dtype = encodings[encoding]['dtype'],
+          metadata = metadata,
+          **options)
+    except BaseException:
+      # a frame failed while the dataset was written, do not leave a truncated file
+      if(os.path.isfile(out)):
+        os.remove(out)
+      raise
     click.echo(f'TIFF dataset written to {out}')
     for d in tmpdirs:
       try:
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import os
+import collections
+import concurrent.futures
+
+import numpy as np
+
+import cmoreader
+
+###
+# Vectorized line drawing
+###
+
+def world_to_pixel(points, size, extent):
+  """
+  Pixel coordinates (column, row) of simulation coordinates
+    points : (n, dim) simulation coordinates, only X and Y are used
+    size   : image width and height in pixels
+    extent : width of the field of view in micrometers, centered on the origin
+  """
+  scale = size / extent
+  return np.column_stack([ (points[:, 0] + extent/2) * scale, (extent/2 - points[:, 1]) * scale ])
+
+def draw_segments(image, start, end, value=True, width=1):
+  """
+  Draw line segments into an image, all at once
+    image      : 2-D array, modified in place
+    start, end : (n, 2) pixel coordinates (column, row) of the segment ends
+    value      : pixel value of the lines
+    width      : line width in pixels
+
+  Every segment is sampled once per pixel along its longest axis, the samples
+  outside of the image are dropped.
+  """
+  if(len(start) == 0):
+    return image
+  delta = end - start
+  steps = np.ceil(np.max(np.abs(delta), axis=1)).astype(np.int64) + 1
+  seg = np.repeat(np.arange(len(start)), steps)
+  # position of every sample along its segment, from 0 to 1
+  first = np.cumsum(steps) - steps
+  t = (np.arange(len(seg)) - first[seg]) / np.maximum(steps[seg] - 1, 1)
+  cols = np.floor(start[seg, 0] + t * delta[seg, 0]).astype(np.int64)
+  rows = np.floor(start[seg, 1] + t * delta[seg, 1]).astype(np.int64)
+  for drow in range(-((width - 1) // 2), width // 2 + 1):
+    for dcol in range(-((width - 1) // 2), width // 2 + 1):
+      r, c = rows + drow, cols + dcol
+      inside = (r >= 0) & (r < image.shape[0]) & (c >= 0) & (c < image.shape[1])
+      image[r[inside], c[inside]] = value
+  return image
+
+def fiber_segments(fibers, select=None):
+  """
+  Segments between the consecutive vertices of the fibers
+    fibers : dict returned by CmoReader.fibers
+    select : boolean mask of the fibers to keep, defaults to all fibers
+  returns the (n, dim) start and end points
+  """
+  size = fibers['size']
+  points = fibers['points']
+  if(select is None):
+    select = np.ones(len(size), dtype=bool)
+  # segment i joins the vertices i and i+1, unless i is the last vertex of a fiber
+  vertex_fiber = np.repeat(np.arange(len(size)), size)
+  keep = (vertex_fiber[:-1] == vertex_fiber[1:]) & select[vertex_fiber[:-1]]
+  idx = np.nonzero(keep)[0]
+  return points[idx], points[idx + 1]
+
+###
+# Rendering
+###
+
+def render_frame(fibers, channels, size, extent=20.0, width=2):
+  """
+  Rasterize the fibers of one frame, one binary image per channel
+    fibers   : dict returned by CmoReader.fibers
+    channels : fiber property indexes drawn in white in every channel
+    size     : image width and height in pixels
+    extent   : width of the field of view in micrometers
+    width    : line width in pixels
+  returns a (len(channels), size, size) boolean array
+
+  As with play, the other fibers are invisible in a fiber channel.
+  """
+  images = np.zeros((len(channels), size, size), dtype=bool)
+  for ich, classes in enumerate(channels):
+    start, end = fiber_segments(fibers, np.isin(fibers['class'], classes))
+    draw_segments(images[ich], world_to_pixel(start, size, extent), world_to_pixel(end, size, extent), True, width)
+  return images
+
+# one reader per trajectory and worker process
+_readers = dict()
+
+def render_cmo_frame(filepath, frm, channels, size, extent=20.0, width=2):
+  """
+  Rasterize one frame of objects.cmo (see render_frame)
+  """
+  if(filepath not in _readers):
+    _readers[filepath] = cmoreader.CmoReader(filepath)
+  return render_frame(_readers[filepath].fibers(frm), channels, size, extent, width)
+
+def channel_classes(simdir, channels):
+  """
+  Fiber property indexes of every channel
+    simdir   : simulation directory
+    channels : list of fiber class names
+  raises a RuntimeError for the channels which are not fibers
+  """
+  classes = { name : idx for idx, name in cmoreader.fiber_classes(simdir).items() }
+  for ch in channels:
+    if(ch not in classes):
+      raise RuntimeError(f'channel "{ch}" is not a fiber class, only fibers can be rasterized (use play)')
+  return [ [classes[ch]] for ch in channels ]
+
+def rendered_frames(simdir, frames, channels, size, extent=20.0, width=2, workers=0):
+  """
+  Rasterize frames of simdir/objects.cmo on a process pool, in order
+    simdir   : simulation directory
+    frames   : list of frame indexes
+    channels : list of fiber class names, one channel each
+    size     : image width and height in pixels
+    extent   : width of the field of view in micrometers
+    width    : line width in pixels
+    workers  : number of processes (0: number of cores)
+  yields a (len(channels), size, size) boolean array per frame, at most two
+  frames per process are rendered ahead of the consumer
+  """
+  filepath = os.path.join(simdir, 'objects.cmo')
+  classes = channel_classes(simdir, channels)
+  # build the frame index once, the workers only load it
+  cmoreader.frame_index(filepath)
+  workers = workers if workers > 0 else os.cpu_count()
+  with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+    pending = collections.deque()
+    for frm in frames:
+      pending.append(pool.submit(render_cmo_frame, filepath, frm, classes, size, extent, width))
+      if(len(pending) > 2*workers):
+        yield pending.popleft().result()
+    while(len(pending)):
+      yield pending.popleft().result()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import hashlib
+
+import framestore
+import cmoreader
+
+###
+# Incremental result cache
+###
+
+CACHE_DIR = '.pycytosim-cache'
+
+# bytes hashed at the beginning and at the end of the trajectory
+CACHE_HASH_BYTES = 1 << 20
+
+def trajectory_identity(filepath):
+  """
+  Identity of a trajectory: size, modification time and a hash of its first and last megabyte
+  """
+  stat = os.stat(filepath)
+  digest = hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode('ascii'))
+  with open(filepath, 'rb') as handle:
+    digest.update(handle.read(CACHE_HASH_BYTES))
+    if(stat.st_size > CACHE_HASH_BYTES):
+      handle.seek(max(CACHE_HASH_BYTES, stat.st_size - CACHE_HASH_BYTES))
+      digest.update(handle.read(CACHE_HASH_BYTES))
+  return digest.hexdigest()
+
+class ResultCache:
+  """
+  Report results of one operation, accumulated over all runs on the same trajectory
+    simdir : simulation directory
+    op     : report operation (e.g. 'fiber:position')
+
+  The cache file is keyed by the operation and the identity of objects.cmo, and
+  holds every frame computed so far, so a request only runs 'report' for the
+  frames that are missing. Writing it removes the files of the operation kept
+  for earlier states of the trajectory (e.g. before it grew).
+  """
+  def __init__(self, simdir, op):
+    self._simdir = simdir
+    self._op = op
+    self._cmo = os.path.join(simdir, 'objects.cmo')
+    identity = trajectory_identity(self._cmo)
+    self._prefix = os.path.join(simdir, CACHE_DIR, op.replace(':','_') + '-')
+    self._filepath = self._prefix + identity + '.pickle'
+    self._table = None
+    if(os.path.isfile(self._filepath)):
+      try:
+        _, self._table = framestore.load(self._filepath)
+      except Exception as e:
+        print(f'ignoring unreadable cache file "{self._filepath}": {e}')
+
+  @property
+  def table(self):
+    return self._table
+
+  @staticmethod
+  def available(simdir):
+    return os.path.isfile(os.path.join(simdir, 'objects.cmo'))
+
+  def frames(self, frames=None):
+    """Requested frames, all frames of the trajectory by default"""
+    if(frames is None):
+      return list(range(len(cmoreader.frame_index(self._cmo)['offsets'])))
+    return list(frames)
+
+  def missing(self, frames=None):
+    """Requested frames that are not in the cache"""
+    num_frames = len(cmoreader.frame_index(self._cmo)['offsets'])
+    frames = [ frm for frm in self.frames(frames) if frm < num_frames ]
+    if(self._table is None):
+      return frames
+    return [ frm for frm in frames if frm not in self._table ]
+
+  def merge(self, table):
+    """Add newly computed frames and write the cache"""
+    if(self._table is not None):
+      table = framestore.FrameTable.concat([self._table, table.select([ frm for frm in table.keys() if frm not in self._table ])])
+    self._table = table.select(sorted(table.keys()))
+    os.makedirs(os.path.dirname(self._filepath), exist_ok=True)
+    tmp = self._filepath + '.tmp'
+    framestore.save(tmp, self._simdir, self._table)
+    os.replace(tmp, self._filepath)
+    self.evict()
+
+  def evict(self):
+    """Remove the cache files of this operation which belong to other states of the trajectory"""
+    for filepath in glob.glob(glob.escape(self._prefix) + '*.pickle'):
+      if(filepath != self._filepath):
+        try:
+          os.remove(filepath)
+        except OSError as e:
+          print(f'could not remove the stale cache file "{filepath}": {e}')
+
+  def select(self, frames=None):
+    """Table with exactly the requested frames (the ones the trajectory has)"""
+    return self._table.select([ frm for frm in self.frames(frames) if frm in self._table ])
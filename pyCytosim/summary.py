@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import pickle
+
+import numpy as np
+
+###
+# Online per-frame reducers
+###
+
+# format tag of the serialized summaries
+FORMAT_SUMMARY = 'summary'
+
+class Reducer:
+  """
+  Per-frame summary of a report operation
+    op : report operation the reducer applies to (e.g. 'fiber:cluster')
+
+  reduce() gets the columns of one frame, as stored in a FrameTable, and
+  returns a dict of scalars or fixed-size arrays; every key becomes a time
+  series of the summary.
+  """
+  op = None
+
+  def reduce(self, cols):
+    raise NotImplementedError
+
+class ClusterSize(Reducer):
+  """
+  Number of clusters, mean cluster size and histogram of the cluster sizes
+    bins : number of histogram bins, the last bin counts all larger clusters
+  """
+  op = 'fiber:cluster'
+
+  def __init__(self, bins=64):
+    self.bins = bins
+
+  def reduce(self, cols):
+    size = np.asarray(cols['size'], dtype=np.int64)
+    return { 'cluster_count' : len(size),
+             'cluster_size_mean' : np.mean(size) if len(size) else np.nan,
+             'cluster_size_hist' : np.bincount(np.minimum(size, self.bins - 1), minlength=self.bins) }
+
+class FiberLength(Reducer):
+  """
+  Fiber count and length statistics over all fiber classes, and per class
+    classes : number of classes in the per-class series ('fiber_class_count' and
+              'fiber_class_length_mean'), in the order of the report, NaN for
+              the classes a frame does not have
+  """
+  op = 'fiber:length'
+
+  def __init__(self, classes=8):
+    self.classes = classes
+
+  def reduce(self, cols):
+    count = np.asarray(cols['count'], dtype=np.float64)
+    total = np.sum(count)
+    per_class = { 'fiber_class_count' : np.full(self.classes, np.nan), 'fiber_class_length_mean' : np.full(self.classes, np.nan) }
+    num = min(len(count), self.classes)
+    per_class['fiber_class_count'][:num] = count[:num]
+    per_class['fiber_class_length_mean'][:num] = np.asarray(cols['avg'], dtype=np.float64)[:num]
+    if(total <= 0):
+      return { 'fiber_count' : 0.0, 'fiber_length_mean' : np.nan, 'fiber_length_dev' : np.nan,
+               'fiber_length_min' : np.nan, 'fiber_length_max' : np.nan, 'fiber_length_total' : 0.0, **per_class }
+    mean = np.sum(cols['tot']) / total
+    # pooled variance of the classes
+    var = np.sum(count * (np.asarray(cols['dev'])**2 + np.asarray(cols['avg'])**2)) / total - mean**2
+    used = count > 0
+    return { 'fiber_count' : total, 'fiber_length_mean' : mean, 'fiber_length_dev' : np.sqrt(max(var, 0.0)),
+             'fiber_length_min' : np.min(np.asarray(cols['min'])[used]), 'fiber_length_max' : np.max(np.asarray(cols['max'])[used]),
+             'fiber_length_total' : np.sum(cols['tot']), **per_class }
+
+class OrientationOrder(Reducer):
+  """
+  Fiber count, mean cosine (polar order) and nematic order parameter <2 cos^2 - 1> from cosC
+  """
+  op = 'fiber:position'
+
+  def reduce(self, cols):
+    cos = np.asarray(cols['cosC'], dtype=np.float64)
+    cos = cos[np.isfinite(cos)]
+    if(len(cos) == 0):
+      return { 'fiber_count' : len(cols['cosC']), 'polar_order' : np.nan, 'nematic_order' : np.nan }
+    return { 'fiber_count' : len(cols['cosC']), 'polar_order' : np.mean(cos), 'nematic_order' : np.mean(2.0*cos**2 - 1.0) }
+
+class SingleForce(Reducer):
+  """
+  Number of singles reported and statistics of their force magnitudes, plus the net force
+  """
+  op = 'single:force'
+
+  def reduce(self, cols):
+    force = np.asarray(cols.get('force', np.zeros((0, 0))))
+    if('magnitude' not in cols)or(force.ndim != 2)or(force.shape[1] != 2):
+      raise RuntimeError(f'single:force columns {sorted(cols.keys())} do not hold one (forceX, forceY) row per single')
+    mag = np.asarray(cols['magnitude'], dtype=np.float64)
+    if(len(mag) == 0):
+      return { 'single_count' : 0, 'force_mean' : np.nan, 'force_dev' : np.nan, 'force_median' : np.nan,
+               'force_max' : np.nan, 'force_total' : 0.0, 'force_net' : np.zeros(2) }
+    return { 'single_count' : len(mag), 'force_mean' : np.mean(mag), 'force_dev' : np.std(mag), 'force_median' : np.median(mag),
+             'force_max' : np.max(mag), 'force_total' : np.sum(mag), 'force_net' : np.sum(cols['force'], axis=0) }
+
+def builtin_reducers():
+  """One instance of every built-in reducer"""
+  return [ ClusterSize(), FiberLength(), OrientationOrder(), SingleForce() ]
+
+def for_op(reducers, op):
+  """Reducers that apply to a given report operation"""
+  if(reducers is None):
+    return []
+  return [ r for r in reducers if r.op == op ]
+
+class SummaryBuilder:
+  """
+  Accumulate the reducer outputs of every frame, in the order they are appended
+    op       : report operation
+    reducers : list of Reducer instances for this operation
+  """
+  def __init__(self, op, reducers):
+    self._op = op
+    self._reducers = reducers
+    self._frames = []
+    self._series = dict()
+
+  def __len__(self):
+    return len(self._frames)
+
+  def append(self, frm, cols):
+    for reducer in self._reducers:
+      for name, val in reducer.reduce(cols).items():
+        self._series.setdefault(name, []).append(val)
+    self._frames.append(frm)
+
+  def build(self):
+    return { 'format' : FORMAT_SUMMARY, 'op' : self._op, 'frames' : np.asarray(self._frames, dtype=np.int64),
+             'series' : { name : np.asarray(vals) for name, vals in self._series.items() } }
+
+def summarize(table, reducers):
+  """
+  Summary of a FrameTable
+  returns None if no reducer applies to its operation
+  """
+  reducers = for_op(reducers, table.op)
+  if(len(reducers) == 0):
+    return None
+  builder = SummaryBuilder(table.op, reducers)
+  for frm, cols in table.items():
+    builder.append(frm, cols)
+  return builder.build()
+
+def is_summary(data):
+  return isinstance(data, dict) and (data.get('format', None) == FORMAT_SUMMARY)
+
+def filename(fname):
+  """Summary file name of a report result file"""
+  if(fname.endswith('.pickle')):
+    fname = fname[:-len('.pickle')]
+  return fname + '.summary.pickle'
+
+def save(filepath, simdir, data):
+  """
+  Write a summary file: the simulation directory followed by the time series
+  """
+  with open(filepath, 'wb') as handle:
+    pickle.dump(simdir, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    pickle.dump(data,   handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+def write(filepath, simdir, table, reducers):
+  """
+  Summarize a FrameTable and write it next to its report result file
+    filepath : path of the report result file
+  """
+  data = summarize(table, reducers)
+  if(data is not None):
+    save(filename(filepath), simdir, data)
+
+def load(filepath):
+  """
+  Read a summary file
+  returns the simulation directory and the summary dict
+  """
+  with open(filepath, 'rb') as handle:
+    simdir = pickle.load(handle)
+    data = pickle.load(handle)
+  if(not is_summary(data)):
+    raise RuntimeError(f'"{filepath}" is not a report summary')
+  return simdir, data
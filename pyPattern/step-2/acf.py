@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import os
+import pickle
+import socket
+
+import numpy as np
+
+import pyfftw
+
+###
+# FFT sizes
+###
+
+def smooth_size(n):
+  """Smallest 2/3/5-smooth integer not below n"""
+  best = None
+  p5 = 1
+  while(p5 < 2*n):
+    p35 = p5
+    while(p35 < 2*n):
+      # smallest power of 2 times p35 not below n
+      m = p35
+      while(m < n):
+        m *= 2
+      if(best is None)or(m < best):
+        best = m
+      p35 *= 3
+    p5 *= 5
+  return best
+
+###
+# FFTW wisdom
+###
+
+# planning efforts, from the fastest planning to the fastest plans
+planners = { 'estimate' : 'FFTW_ESTIMATE', 'measure' : 'FFTW_MEASURE', 'patient' : 'FFTW_PATIENT', 'exhaustive' : 'FFTW_EXHAUSTIVE' }
+
+def wisdom_path():
+  """Per-host FFTW wisdom cache file (wisdom depends on the CPU)"""
+  cache = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+  return os.path.join(cache, 'pyPattern', f'fftw-wisdom-{socket.gethostname()}.pickle')
+
+def _read_wisdom(filepath):
+  try:
+    with open(filepath, 'rb') as handle:
+      return pickle.load(handle)
+  except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+    return dict()
+
+def load_wisdom(filepath, key):
+  """
+  Import the wisdom stored for a key
+    filepath : wisdom cache file
+    key      : plan key (shape, dtype, planner, threads)
+  returns False if the cache holds no wisdom for this key
+  """
+  wisdom = _read_wisdom(filepath).get(key, None)
+  if(wisdom is None):
+    return False
+  pyfftw.import_wisdom(wisdom)
+  return True
+
+def save_wisdom(filepath, key):
+  """
+  Store the current wisdom for a key, keeping the other keys of the cache
+  """
+  cache = _read_wisdom(filepath)
+  cache[key] = pyfftw.export_wisdom()
+  try:
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    # several runs may share the cache, never leave it half written
+    tmp = f'{filepath}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as handle:
+      pickle.dump(cache, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, filepath)
+  except OSError as e:
+    print(f'could not write the FFTW wisdom "{filepath}": {e}')
+
+###
+# Autocorrelation
+###
+
+class AcfEngine:
+  """
+  Autocorrelation of batches of real images with real-to-complex FFTW plans (Wiener-Khinchin)
+    shape   : shape of the autocorrelation (lags 0 to shape-1 along every axis)
+    extent  : rows and columns of the input which hold data, defaults to shape
+    batch   : number of frames transformed by one call
+    threads : number of FFTW threads
+    planner : planning effort (one of planners)
+    wisdom  : wisdom cache file, None to plan from scratch
+    periodic: circular autocorrelation of periodic images, without padding
+    polar   : polar images, padded to twice their shape
+
+  The input is zero-padded to the smallest 2/3/5-smooth size of at least
+  extent + shape - 1 along every axis, so that the lags of interest do not
+  wrap around. Fill engine.input[k] for the frames k of the batch (zeros
+  outside of the data) and call the engine; the input buffer is overwritten.
+  In the periodic mode, the input has the shape of the images and the lags
+  wrap around, as the images do. In the polar mode, the angles repeated once
+  wrap around a buffer of twice the shape of the images, as they always did.
+
+  The plans of a given size, batch, planning effort and number of threads are
+  computed once and then imported from the wisdom cache by every later run.
+  """
+  def __init__(self, shape, extent=None, batch=1, threads=1, planner='measure', wisdom=None, periodic=False, polar=False):
+    self.shape = tuple(shape)
+    self.extent = tuple(extent) if extent is not None else self.shape
+    self.padded = padded_shape(self.shape, self.extent, periodic, polar)
+    self.batch = batch
+    self.input = pyfftw.empty_aligned((batch,) + self.padded, dtype='float32')
+    self.spectrum = pyfftw.empty_aligned((batch,) + spectrum_shape(self.padded), dtype='complex64')
+    flags = [planners[planner], 'FFTW_DESTROY_INPUT']
+    key = (self.input.shape, str(self.input.dtype), planner, threads)
+    known = (wisdom is not None)and(load_wisdom(wisdom, key))
+    self._forward = pyfftw.FFTW(self.input, self.spectrum, axes=(-2,-1), direction='FFTW_FORWARD', flags=flags, threads=threads)
+    self._backward = pyfftw.FFTW(self.spectrum, self.input, axes=(-2,-1), direction='FFTW_BACKWARD', flags=flags, threads=threads)
+    if(wisdom is not None)and(not known):
+      save_wisdom(wisdom, key)
+
+  def __call__(self):
+    """
+    Autocorrelation of every frame of engine.input, i.e. the sum of the
+    products of the pixels at every lag, as a view of the input buffer
+    """
+    self._forward()
+    # power spectrum, real but stored as complex for the inverse transform
+    np.multiply(self.spectrum, self.spectrum.conj(), out=self.spectrum)
+    self._backward()
+    return self.input[:, :self.shape[0], :self.shape[1]]
+
+def padded_shape(shape, extent, periodic=False, polar=False):
+  """Smooth FFT size of every axis, without wrap-around up to the lag shape-1 (unless periodic or polar)"""
+  if(periodic):
+    return tuple(shape)
+  if(polar):
+    return tuple( 2*s for s in shape )
+  return tuple( smooth_size(e + s - 1) for e, s in zip(extent, shape) )
+
+def spectrum_shape(padded):
+  """Shape of the real-to-complex transform of a padded frame"""
+  return padded[:-1] + (padded[-1]//2 + 1,)
+
+def frame_bytes(shape, extent=None, periodic=False, polar=False):
+  """Memory of the input and spectrum buffers of one frame of an AcfEngine"""
+  padded = padded_shape(shape, extent if extent is not None else shape, periodic, polar)
+  return 4 * int(np.prod(padded)) + 8 * int(np.prod(spectrum_shape(padded)))
+
+def batch_size(shape, extent=None, memory=1024, frames=None, threads=None, periodic=False, polar=False):
+  """
+  Number of frames of an AcfEngine batch which fits a memory budget
+    memory  : budget of the FFT buffers in MB
+    frames  : number of frames to process, bounds the batch
+    threads : number of FFTW threads, bounds the batch (larger batches only
+              add memory traffic once every thread has a frame)
+  """
+  batch = max(1, int(memory * 2**20) // frame_bytes(shape, extent, periodic, polar))
+  for bound in [frames, threads]:
+    if(bound is not None):
+      batch = max(1, min(batch, bound))
+  return batch
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import time
+
+import numpy as np
+import pyfftw
+
+import click
+
+import acf
+import stats
+
+###
+# Reference implementation
+###
+
+class LegacyAcf:
+  """
+  Complex-to-complex ACF over a 2*shape buffer, as correlation-length.py used to compute it
+  """
+  def __init__(self, shape):
+    self.shape = tuple(shape)
+    self.input = pyfftw.empty_aligned([2*shape[0],2*shape[1]], dtype='complex64')
+    self._transform = pyfftw.empty_aligned([2*shape[0],2*shape[1]], dtype='complex64')
+    self._forward = pyfftw.FFTW(self.input, self._transform, axes=[0,1], direction='FFTW_FORWARD', flags=['FFTW_DESTROY_INPUT'])
+    self._backward = pyfftw.FFTW(self._transform, self.input, axes=[0,1], direction='FFTW_BACKWARD', flags=['FFTW_DESTROY_INPUT'])
+
+  def __call__(self):
+    self._forward()
+    self._transform *= self._transform.conj()
+    self._backward()
+    return self.input[:self.shape[0],:self.shape[1]].real
+
+###
+# Synthetic data
+###
+
+def synthetic_frame(shape, rng, density=0.05):
+  """Binary image with randomly lit pixels, smoothed along the rows"""
+  img = (rng.random(shape) < density).astype(np.float32)
+  img[:, 1:] += img[:, :-1]
+  return img
+
+def fill(buf, img, polar, offset=100, cutoff=200):
+  """Copy a mean-subtracted frame into an FFT input buffer, the way correlation-length.py does"""
+  buf.fill(0)
+  if(polar):
+    img_tmp = img - np.mean(img[:, offset:cutoff])
+    buf[:360,offset:cutoff] = img_tmp[:360,offset:cutoff]
+    buf[360:720,offset:cutoff] = img_tmp[:360,offset:cutoff]
+    return np.sum(img_tmp[:, offset:cutoff]**2)
+  img_tmp = img - np.mean(img)
+  buf[:img.shape[0],:img.shape[1]] = img_tmp
+  return np.sum(img_tmp**2)
+
+def legacy_stats(img):
+  """Frame statistics with one NumPy reduction each, as correlation-length.py used to compute them"""
+  img_mean = np.nanmean(np.ravel(img))
+  img_std = np.nanstd(np.ravel(img), dtype=np.float128)
+  img_kurt = np.nanmean((np.ravel(img).astype(np.float128) - img_mean)**4) / img_std**4 - 3
+  img_median = np.nanmedian(np.ravel(img))
+  img_total = np.nansum(np.ravel((img - img_mean)**2))
+  return np.array([img_mean, img_median, img_std, img_kurt, img_total, np.count_nonzero(~np.isnan(img))], dtype=np.float64)
+
+def exact_stats(img):
+  """Frame statistics of the valid pixels in float128, as the reference of the accuracy"""
+  x = np.ravel(img)[~np.isnan(np.ravel(img))].astype(np.float128)
+  mean = np.mean(x)
+  m2 = np.sum((x - mean)**2)
+  m4 = np.sum((x - mean)**4)
+  return np.array([mean, np.median(x), np.sqrt(m2 / x.size), x.size * m4 / m2**2 - 3, m2, x.size], dtype=np.float64)
+
+def synthetic_page(shape, rng, dtype):
+  """Integer page with a dark background (zeros) and Poisson-distributed intensities"""
+  page = rng.poisson(20.0, shape) * (rng.random(shape) < 0.7)
+  return np.minimum(page * (np.iinfo(dtype).max // 255), np.iinfo(dtype).max).astype(dtype)
+
+###
+# Benchmarks
+###
+
+@click.group()
+def main():
+  pass
+
+@main.command('acf')
+@click.option("--sizes", default='512,800,1024', help="A comma-separated list of image sizes (square images).")
+@click.option("--frames", default=10, help="Number of frames per size.")
+@click.option("--polar", is_flag=True, help="Polar layout (360 angles repeated once, radii 100 to 200).")
+def bench_acf(sizes : str, frames : int, polar : bool):
+  """Compare the complex-to-complex and the real-to-complex ACF."""
+  rng = np.random.default_rng(0)
+  for size in map(int, sizes.split(',')):
+    shape = (size, size)
+    imgs = [ synthetic_frame(shape, rng) for i in range(frames) ]
+    legacy = LegacyAcf(shape)
+    engine = acf.AcfEngine(shape, (720, size) if polar else shape, polar=polar)
+    timings = dict()
+    results = dict()
+    for name, acf_engine, buf in [('complex 2x', legacy, legacy.input), ('real smooth', engine, engine.input[0])]:
+      results[name] = []
+      time_start = time.perf_counter()
+      for img in imgs:
+        total = fill(buf, img, polar)
+        results[name].append(np.reshape(acf_engine(), img.shape) / total)
+      timings[name] = (time.perf_counter() - time_start) / frames
+    diff = max( np.max(np.abs(a - b)) for a, b in zip(results['complex 2x'], results['real smooth']) )
+    click.echo(f'{size}x{size}: padded {legacy.input.shape} -> {engine.padded}, '
+               f'{1e3*timings["complex 2x"]:8.2f} ms -> {1e3*timings["real smooth"]:8.2f} ms per frame '
+               f'({timings["complex 2x"]/timings["real smooth"]:.2f}x), max ACF difference {diff:.2e}')
+
+@main.command('acf-batch')
+@click.option("--size", default=800, help="Image size (square images).")
+@click.option("--frames", default=64, help="Number of frames.")
+@click.option("--memory", default=','.join(map(str, [0, 256, 1024])), help="A comma-separated list of memory budgets in MB (0: one frame per call).")
+@click.option("--threads", default='1,4,0', help="A comma-separated list of FFTW thread counts (0: number of cores).")
+def bench_acf_batch(size : int, frames : int, memory : str, threads : str):
+  """Throughput of batched, multi-threaded ACF plans."""
+  import os
+  rng = np.random.default_rng(0)
+  shape = (size, size)
+  imgs = [ synthetic_frame(shape, rng) for i in range(frames) ]
+  click.echo(f'{frames} frame(s) of {size}x{size} pixels, {acf.frame_bytes(shape)/2**20:.1f} MB per frame, {os.cpu_count()} core(s)')
+  reference, time_single = None, None
+  for nthreads in map(int, threads.split(',')):
+    nthreads = nthreads if nthreads > 0 else os.cpu_count()
+    for budget in map(int, memory.split(',')):
+      batch = acf.batch_size(shape, None, budget, frames, nthreads)
+      engine = acf.AcfEngine(shape, None, batch, nthreads)
+      results = []
+      time_start = time.perf_counter()
+      for ibatch in range(0, frames, batch):
+        chunk = imgs[ibatch:ibatch+batch]
+        totals = [ fill(engine.input[k], img, False) for k, img in enumerate(chunk) ]
+        batch_acf = engine()
+        results.extend( batch_acf[k] / total for k, total in enumerate(totals) )
+      elapsed = time.perf_counter() - time_start
+      if(reference is None):
+        reference, time_single = results, elapsed
+      diff = max( np.max(np.abs(a - b)) for a, b in zip(reference, results) )
+      click.echo(f'  {nthreads:3d} thread(s), batch {batch:4d}: {frames/elapsed:8.1f} frames/s, speedup {time_single/elapsed:6.2f}x, max ACF difference {diff:.2e}')
+
+@main.command('acf-wisdom')
+@click.option("--sizes", default='512,800,1024', help="A comma-separated list of image sizes (square images).")
+@click.option("--planner", default='measure,patient', help="A comma-separated list of planning efforts: " + ", ".join(acf.planners.keys()))
+def bench_acf_wisdom(sizes : str, planner : str):
+  """Planning time of the ACF plans without and with the wisdom cache."""
+  import os
+  import tempfile
+  with tempfile.TemporaryDirectory() as cachedir:
+    wisdom = os.path.join(cachedir, 'wisdom.pickle')
+    for size in map(int, sizes.split(',')):
+      for effort in planner.split(','):
+        timings = []
+        for run in ['cold', 'warm']:
+          # a new process starts without wisdom
+          pyfftw.forget_wisdom()
+          time_start = time.perf_counter()
+          acf.AcfEngine((size, size), planner=effort, wisdom=wisdom)
+          timings.append(time.perf_counter() - time_start)
+        click.echo(f'{size}x{size} {effort:10s}: planning {timings[0]:8.3f} s without wisdom, {timings[1]:8.3f} s with the cache ({timings[0]/timings[1]:.0f}x)')
+
+@main.command('acf-periodic')
+@click.option("--sizes", default='512,800,1024', help="A comma-separated list of image sizes (square images).")
+@click.option("--frames", default=10, help="Number of frames per size.")
+def bench_acf_periodic(sizes : str, frames : int):
+  """Compare the padded and the periodic ACF, check the latter against np.fft."""
+  import profiles
+  rng = np.random.default_rng(0)
+  for size in map(int, sizes.split(',')):
+    shape = (size, size)
+    imgs = [ synthetic_frame(shape, rng) for i in range(frames) ]
+    timings = dict()
+    for name, periodic in [('padded', False), ('periodic', True)]:
+      engine = acf.AcfEngine(shape, periodic=periodic)
+      profile = profiles.profile_engine('periodic' if periodic else 'cartesian', shape, size)
+      diff = 0.0
+      time_start = time.perf_counter()
+      for img in imgs:
+        total = fill(engine.input[0], img, False)
+        res = profile(engine()[0] / total)
+        if(periodic):
+          img_tmp = img - np.mean(img)
+          ref = np.fft.irfft2(np.abs(np.fft.rfft2(img_tmp))**2, s=shape) / total
+          diff = max(diff, np.max(np.abs(engine.input[0] / total - ref)))
+      timings[name] = (time.perf_counter() - time_start) / frames
+    click.echo(f'{size}x{size}: {acf.frame_bytes(shape)/2**20:6.1f} MB -> {acf.frame_bytes(shape, periodic=True)/2**20:6.1f} MB per frame, '
+               f'{1e3*timings["padded"]:8.2f} ms -> {1e3*timings["periodic"]:8.2f} ms per frame (including the np.fft check), '
+               f'max difference to np.fft {diff:.2e}')
+
+@main.command('frame-stats')
+@click.option("--sizes", default='512,800,1024', help="A comma-separated list of image sizes (square images).")
+@click.option("--frames", default=10, help="Number of frames per size.")
+def bench_frame_stats(sizes : str, frames : int):
+  """Compare the frame statistics of stats.py with one NumPy reduction per statistic."""
+  rng = np.random.default_rng(0)
+  for dtype in [np.uint8, np.uint16]:
+    for size in map(int, sizes.split(',')):
+      pages = [ synthetic_page((size, size), rng, dtype) for i in range(frames) ]
+      imgs = []
+      for page in pages:
+        # as skimage.util.img_as_float32
+        img = page.astype(np.float32) / np.iinfo(dtype).max
+        img[img == 0.0] = np.nan
+        imgs.append(img)
+      timings = dict()
+      results = dict()
+      for name, func in [('legacy', lambda img, page : legacy_stats(img)), ('stats', lambda img, page : stats.frame_stats(img, page))]:
+        time_start = time.perf_counter()
+        results[name] = [ func(img, page) for img, page in zip(imgs, pages) ]
+        timings[name] = (time.perf_counter() - time_start) / frames
+      reference = [ exact_stats(img) for img in imgs ]
+      click.echo(f'{np.dtype(dtype).name:6s} {size}x{size}: {1e3*timings["legacy"]:8.2f} ms -> {1e3*timings["stats"]:8.2f} ms per frame '
+                 f'({timings["legacy"]/timings["stats"]:.1f}x)')
+      # relative error against the float128 statistics of the same pixels
+      for name in ['legacy', 'stats']:
+        diff = np.max([ np.abs(a - b) / np.maximum(np.abs(a), 1e-12) for a, b in zip(reference, results[name]) ], axis=0)
+        click.echo(f'  {name:6s} max relative error ' + ', '.join( f'{col} {d:.1e}' for col, d in zip(stats.columns, diff) ))
+
+if __name__ == "__main__":
+  main()
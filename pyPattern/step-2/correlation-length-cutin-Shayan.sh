@@ -15,6 +15,11 @@ IDX_FILE=0
 
 SL=0
 
+# share the cores between the N parallel runs, at least one thread each
+# (--threads 0 would give every run all the cores)
+THREADS=$(( $(nproc) / N ))
+[ $THREADS -lt 1 ] && THREADS=1
+
 echo "$FILES" | (
   while read filepath; do
   
@@ -28,7 +33,7 @@ echo "$FILES" | (
     [ -d "${OUT}" ] || mkdir -p "${OUT}"
 
     for CH in 0; do
-      ARGS=""
+      ARGS="--threads ${THREADS}"
 
       echo "Processing $filepath ${IDX_FILE}/${NUM_FILES}..."
       { ${SCRIPT_PATH} --tiff "$filepath" --channels ${CH} --slices ${SL} ${ARGS} --out "${OUT}/${SCRIPT_NAME}.pickle" 2>&1; } >"${OUT}/${SCRIPT_NAME}.log" &
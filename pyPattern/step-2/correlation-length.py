@@ -8,8 +8,6 @@ import tifffile
 import pickle
 import json
 
-import pyfftw
-
 import numpy as np
 import scipy.signal
 import scipy.optimize
@@ -18,6 +16,10 @@ import skimage.util
 
 import click
 
+import acf
+import profiles
+import stats
+
 def write_out(handle, *args):
   for v in args:
     pickle.dump(v, handle, protocol=pickle.HIGHEST_PROTOCOL)
@@ -33,7 +35,12 @@ def write_out(handle, *args):
 @click.option("--metadata", default=None, help="Metadata file.")
 @click.option("--polar", default=None, help="Polar coordinates.")
 @click.option("--binary", is_flag=True, help="Binary image.")
-def main(tiff : str, channels : str, slices : str, out : str, frames : str ='all', metadata : str=None, polar : str=None, binary : bool=False):
+@click.option("--memory", default=1024, help="Memory budget of the FFT buffers in MB, sets the number of frames transformed at once.")
+@click.option("--threads", default=0, help="Number of FFTW threads (0: number of cores).")
+@click.option("--planner", default='measure', type=click.Choice(list(acf.planners.keys())), help="FFTW planning effort, the plans are cached per host and reused by later runs.")
+@click.option("--wisdom", default=None, help="FFTW wisdom cache file (defaults to a per-host file in ~/.cache/pyPattern, 'none' to disable).")
+@click.option("--periodic", is_flag=True, help="Periodic images (e.g. simulations in periodic space): circular ACF without padding, binned by minimum-image distance.")
+def main(tiff : str, channels : str, slices : str, out : str, frames : str ='all', metadata : str=None, polar : str=None, binary : bool=False, memory : int=1024, threads : int=0, planner : str='measure', wisdom : str=None, periodic : bool=False):
 
   # input file
   if (tiff is None)or(not os.path.isfile(tiff)):
@@ -104,6 +111,9 @@ def main(tiff : str, channels : str, slices : str, out : str, frames : str ='all
     elif(polar.startswith('ang')):
       do_polar = 2
       
+  if(periodic)and(do_polar):
+    click.echo(f'Invalid options: polar images are not periodic')
+    return
 
   # initialize the data structures
   zero_pad = True
@@ -200,16 +210,23 @@ def main(tiff : str, channels : str, slices : str, out : str, frames : str ='all
         res_acf = np.zeros((np.max(size)),dtype=np.float)
       else:
         res_acf = np.zeros((360),dtype=np.float)
-      if(do_polar==0):
-        xi = range(np.max(size))
-        X, Y = np.meshgrid(xi, xi)
-        rho = np.floor(np.sqrt(X**2 + Y**2))
+      # radius (or angle) bins of the ACF pixels
+      if(do_polar==1):
+        profile = profiles.profile_engine('radial', tuple(size), len(res_acf))
+      elif(do_polar==2):
+        profile = profiles.profile_engine('angular', tuple(size), len(res_acf))
+      elif(periodic):
+        profile = profiles.profile_engine('periodic', tuple(size), len(res_acf))
+      else:
+        profile = profiles.profile_engine('cartesian', tuple(size), len(res_acf))
 
-      # FFT vars
-      original_fft = pyfftw.empty_aligned([2*size[0],2*size[1]], dtype='complex64')
-      transform_fft = pyfftw.empty_aligned([2*size[0],2*size[1]], dtype='complex64')
-      fft_object = pyfftw.FFTW(original_fft, transform_fft, axes=[0,1], direction='FFTW_FORWARD', flags=['FFTW_DESTROY_INPUT'])
-      ifft_object = pyfftw.FFTW(transform_fft, original_fft, axes=[0,1], direction='FFTW_BACKWARD', flags=['FFTW_DESTROY_INPUT'])
+      # FFT vars, batches of frames within the memory budget
+      # the polar images are repeated once along the angle
+      extent = (720, size[1]) if do_polar else size
+      threads = threads if threads > 0 else os.cpu_count()
+      batch = acf.batch_size(size, extent, memory, len(frames), threads, periodic, do_polar > 0)
+      click.echo(f'Transforming {batch} frame(s) at once with {threads} thread(s)')
+      acf_engine = acf.AcfEngine(size, extent, batch, threads, planner, None if wisdom == 'none' else (wisdom or acf.wisdom_path()), periodic, do_polar > 0)
 
       if debug:
         frm_residuals = np.zeros((len(frames),np.max(size)), dtype=np.float)
@@ -220,262 +237,260 @@ def main(tiff : str, channels : str, slices : str, out : str, frames : str ='all
         
         num_panels = 4 if do_polar else 5
 
-      frm_img_avg_med = np.zeros((len(frames),2), dtype=np.float)
+      frm_img_avg_med = np.zeros((len(frames),len(stats.columns)), dtype=np.float)
       frm_img_avg_med.fill(np.nan)
       
-      for ifrm, frm in enumerate(frames):
-        click.echo(f'Frame {frm}...')
-
-        page = s.pages[frm*num_slices*num_channels + sl*num_channels + ch]
-        #print(f'max(img) = {np.max(np.ravel(img))}')
-        if(binary):
-          img = page.asarray()
-          img[img > 0.0] = 1.0
-        else:
-          img = skimage.util.img_as_float32(page.asarray())
-          mask = img == 0.0
-          img[mask] = np.nan
-
-        original_fft.fill(0)
-        if(do_polar):
-          img_mean = np.nanmean(np.ravel(img[:,offset:cutoff]))
-          img_median = np.nanmedian(np.ravel(img[:,offset:cutoff]))
-          
-          img_tmp = img - img_mean
-          img_total = np.nansum(np.ravel(img_tmp[:,offset:cutoff]**2))
-          if(not binary):
-            img_tmp[mask] = 0.0
-          original_fft[:360,offset:cutoff] = img_tmp[:360,offset:cutoff]
-          original_fft[360:720,offset:cutoff] = img_tmp[:360,offset:cutoff]
-        else:
-          img_mean = np.nanmean(255*np.ravel(img))
-          img_std = np.nanstd(255*np.ravel(img), dtype=np.float128)
-          img_kurt = 
-          img_median = np.nanmedian(np.ravel(img))
-          
-          print(f'mean(img) = {img_mean}')
-          print(f'median(img) = {img_median}')
-          
-          img_tmp = img - img_mean
-          img_total = np.nansum(np.ravel(img_tmp**2))
-          if(not binary):
-            img_tmp[mask] = 0.0
-          original_fft[:size[0],:size[1]] = img_tmp[:]
+      indexed_frames = list(enumerate(frames))
+      for ibatch in range(0, len(frames), batch):
+        chunk = indexed_frames[ibatch:ibatch+batch]
+        totals = np.full(len(chunk), np.nan)
+        imgs = [None] * len(chunk)
+
+        # load the frames of the batch into the FFT input
+        for k, (ifrm, frm) in enumerate(chunk):
+          click.echo(f'Frame {frm}...')
+
+          page = s.pages[frm*num_slices*num_channels + sl*num_channels + ch].asarray()
+          #print(f'max(img) = {np.max(np.ravel(img))}')
+          if(binary):
+            # uint16, uint8 or 1-bit (bool) pages
+            img = (page > 0).astype(np.float32)
+          else:
+            img = skimage.util.img_as_float32(page)
+            mask = img == 0.0
+            img[mask] = np.nan
+
+          original_fft = acf_engine.input[k]
+          original_fft.fill(0)
+          img_stats = frm_img_avg_med[ifrm]
+          if(do_polar):
+            stats.frame_stats(img[:,offset:cutoff], page[:,offset:cutoff], binary, img_stats)
+            img_mean, img_total = img_stats[stats.column['mean']], img_stats[stats.column['sumsq']]
+
+            img_tmp = img - img_mean
+            if(not binary):
+              img_tmp[mask] = 0.0
+            original_fft[:360,offset:cutoff] = img_tmp[:360,offset:cutoff]
+            original_fft[360:720,offset:cutoff] = img_tmp[:360,offset:cutoff]
+          else:
+            stats.frame_stats(img, page, binary, img_stats)
+            img_mean, img_total = img_stats[stats.column['mean']], img_stats[stats.column['sumsq']]
 
-        frm_img_avg_med[ifrm,:] = img_mean, img_median, img_kurt
+            print(f'mean(img) = {img_mean}')
+            print(f'median(img) = {img_stats[stats.column["median"]]}')
 
-        #img_test[:] = original_fft[:].real
+            img_tmp = img - img_mean
+            if(not binary):
+              img_tmp[mask] = 0.0
+            original_fft[:size[0],:size[1]] = img_tmp[:]
 
-        #import matplotlib.pyplot as plt
-        #import matplotlib.colors as clr
-        #import matplotlib.ticker as tck
-        #import matplotlib.cm as cm
+          #img_test[:] = original_fft[:].real
 
-        #import dufte
-        #plt.rc('text', usetex=True)
-        #plt.rc('font', family = 'serif', serif = 'cm10', size = 12)
-        #plt.style.use(dufte.style)
-        #plt.style.use('dark_background')
+          #import matplotlib.pyplot as plt
+          #import matplotlib.colors as clr
+          #import matplotlib.ticker as tck
+          #import matplotlib.cm as cm
 
-        #fig = plt.figure(figsize=(8,8))
-        #ax = fig.add_subplot(1, 1, 1)
-        #ax.set_title('Test Image', fontsize=48)
-        #ax.imshow(img_test.T, interpolation="none", cmap=plt.cm.gray)
+          #import dufte
+          #plt.rc('text', usetex=True)
+          #plt.rc('font', family = 'serif', serif = 'cm10', size = 12)
+          #plt.style.use(dufte.style)
+          #plt.style.use('dark_background')
 
-        #fig.savefig(os.path.join(os.path.dirname(out),f'test-acf-{ifrm}.png'))
-        #plt.close(fig)
+          #fig = plt.figure(figsize=(8,8))
+          #ax = fig.add_subplot(1, 1, 1)
+          #ax.set_title('Test Image', fontsize=48)
+          #ax.imshow(img_test.T, interpolation="none", cmap=plt.cm.gray)
 
-        #if(ifrm > 10):
-          #quit()
+          #fig.savefig(os.path.join(os.path.dirname(out),f'test-acf-{ifrm}.png'))
+          #plt.close(fig)
 
-        #continue
-        
-        if(np.isnan(img_total))or(img_total <= 0.0):
-          continue
-
-        fft  = fft_object()
-        transform_fft *= transform_fft.conj()
-        ifft = ifft_object()
-
-        img_acf[:] = original_fft[:size[0],:size[1]].real / img_total
-
-        # Get the average radial profile fo the Autocorrelation Function
-        res_acf.fill(0)
-        if(do_polar==1):
-          for ri in range(len(res_acf)):
-            res_acf[ri] = np.nanmean(img_acf[:360,ri])
-        elif(do_polar==2):
-          for fi in range(0,360):
-            res_acf[fi] = np.nanmean(img_acf[fi,:])
-        else:
-          for ri in range(len(res_acf)):
-            xyi = rho == ri
-            res_acf[ri] = np.nanmean(img_acf[xyi])
-
-        if debug:
-          import matplotlib.pyplot as plt
-          import matplotlib.colors as clr
-          import matplotlib.ticker as tck
-          import matplotlib.cm as cm
+          #if(ifrm > 10):
+            #quit()
+
+          #continue
+
+          totals[k] = img_total
+          if debug:
+            imgs[k] = img
+
+        batch_acf = acf_engine()
+
+        for k, (ifrm, frm) in enumerate(chunk):
+          img_total = totals[k]
+          img = imgs[k]
+          if(np.isnan(img_total))or(img_total <= 0.0):
+            continue
+
+          img_acf[:] = batch_acf[k] / img_total
+
+          # Get the average radial profile fo the Autocorrelation Function
+          profile(img_acf, out=res_acf)
+
+          if debug:
+            import matplotlib.pyplot as plt
+            import matplotlib.colors as clr
+            import matplotlib.ticker as tck
+            import matplotlib.cm as cm
           
-          import dufte
-          plt.rc('text', usetex=True)
-          plt.rc('font', family = 'serif', serif = 'cm10', size = 12)
-          plt.style.use(dufte.style)
-          plt.style.use('dark_background')
+            import dufte
+            plt.rc('text', usetex=True)
+            plt.rc('font', family = 'serif', serif = 'cm10', size = 12)
+            plt.style.use(dufte.style)
+            plt.style.use('dark_background')
           
-          fig = plt.figure(figsize=(8*num_panels,8))
-
-          ax = fig.add_subplot(1, num_panels, 1)
-          ax.set_title('Original', fontsize=48)
-          #extent = [0, dx*img_acf.shape[0], dx*img_acf.shape[1], 0]
-          if(do_polar > 0):
-            img[:,0:offset] = np.nan
-            img[:,cutoff:] = np.nan
-            ax.imshow(img[:360,:], interpolation="none", norm=clr.Normalize(1/255,30/255), cmap=plt.cm.gray)
-          else:
-            ax.imshow(img, interpolation="none", cmap=plt.cm.gray) #norm=clr.Normalize(1/255,30/255), cmap=plt.cm.gray)
-
-          #avg[ifrm] = img_mean
-          #median[ifrm] = img_median
+            fig = plt.figure(figsize=(8*num_panels,8))
+
+            ax = fig.add_subplot(1, num_panels, 1)
+            ax.set_title('Original', fontsize=48)
+            #extent = [0, dx*img_acf.shape[0], dx*img_acf.shape[1], 0]
+            if(do_polar > 0):
+              img[:,0:offset] = np.nan
+              img[:,cutoff:] = np.nan
+              ax.imshow(img[:360,:], interpolation="none", norm=clr.Normalize(1/255,30/255), cmap=plt.cm.gray)
+            else:
+              ax.imshow(img, interpolation="none", cmap=plt.cm.gray) #norm=clr.Normalize(1/255,30/255), cmap=plt.cm.gray)
+
+            #avg[ifrm] = img_mean
+            #median[ifrm] = img_median
           
-          ax = fig.add_subplot(1, num_panels, 2)
-          ax.set_xlabel('Time')
-          ax.set_title('Intensity')
-          #ax.set_ylim([1e-2, 1e-1])
-          #ax.set_yscale('log')
-          ax.plot(np.asarray(range(len(frames))), frm_img_avg_med[:,0], label='Mean')
-          ax.plot(np.asarray(range(len(frames))), frm_img_avg_med[:,1], label='Median')
-          ax.legend()
-
-          ax = fig.add_subplot(1, num_panels, 3)
-          ax.set_title('2-D ACF (Real)', fontsize=48)
-          #extent = [0, dx*img_acf.shape[0], dx*img_acf.shape[1], 0]
-          if(do_polar > 0):
-            ax.set_ylabel('Angle')
-            ax.imshow(img_acf[:360,:], interpolation="none", norm=clr.Normalize(-1,1), cmap=plt.cm.seismic)
-          else:
-            ax.imshow(img_acf, interpolation="none", norm=clr.Normalize(-1,1), cmap=plt.cm.seismic)
-
-          ax = fig.add_subplot(1, num_panels, 4)
-          ax.set_title('Avg ACF', fontsize=48)
-          if(do_polar==1):
-            ax.set_ylim([-0.05, 1])
-            ax.set_xlabel('Radial Distance')
-            ax.plot(np.linspace(0,len(res_acf)-1,len(res_acf)), res_acf)
-          elif(do_polar==2):
-            ax.set_ylabel('Angle')
-            ax.plot(res_acf, np.linspace(0,359,360))
-            ax.invert_yaxis()
-          else:
-            #peaks, properties = scipy.signal.find_peaks(-res_acf, prominence=None, width=10)
-            #if(len(peaks)):
-              #def f(x, a, b):
-                #return a + np.exp(b * x)
-              #xdata = np.asarray(range(peaks[0]+1))
-              #ydata = res_acf[0:peaks[0]+1]
-              #popt, pcov = scipy.optimize.curve_fit(f, xdata, ydata, p0=[1,-1], bounds=((-np.inf, -np.inf), (np.inf, 0)), maxfev=10000)
-              #print(popt)
-              #A[ifrm] = popt[1]
-              #ax.plot(xdata, f(xdata, *popt))
-            xdata = np.asarray(range(len(res_acf)))
-            ydata = res_acf
-            #for c in range(1,11):
-            if 1:
-              def f(x, a, b, c):
-                return a *  np.exp( - b * x ) + (1 - a) * np.exp( - c * x ) #np.power(1 + x, -b)#a * np.exp( -b * x ) + (1 - a) * np.exp( -c * x )
-              popt, pcov = scipy.optimize.curve_fit(f, xdata, ydata, p0=[0.5, 1, 10], bounds=((0, 0, 0), (1, np.inf, np.inf)), maxfev=10000)
-              print(popt)
-              frm_params[ifrm,:] = popt[:]
+            ax = fig.add_subplot(1, num_panels, 2)
+            ax.set_xlabel('Time')
+            ax.set_title('Intensity')
+            #ax.set_ylim([1e-2, 1e-1])
+            #ax.set_yscale('log')
+            ax.plot(np.asarray(range(len(frames))), frm_img_avg_med[:,stats.column['mean']], label='Mean')
+            ax.plot(np.asarray(range(len(frames))), frm_img_avg_med[:,stats.column['median']], label='Median')
+            ax.legend()
+
+            ax = fig.add_subplot(1, num_panels, 3)
+            ax.set_title('2-D ACF (Real)', fontsize=48)
+            #extent = [0, dx*img_acf.shape[0], dx*img_acf.shape[1], 0]
+            if(do_polar > 0):
+              ax.set_ylabel('Angle')
+              ax.imshow(img_acf[:360,:], interpolation="none", norm=clr.Normalize(-1,1), cmap=plt.cm.seismic)
+            else:
+              ax.imshow(img_acf, interpolation="none", norm=clr.Normalize(-1,1), cmap=plt.cm.seismic)
+
+            ax = fig.add_subplot(1, num_panels, 4)
+            ax.set_title('Avg ACF', fontsize=48)
+            if(do_polar==1):
+              ax.set_ylim([-0.05, 1])
+              ax.set_xlabel('Radial Distance')
+              ax.plot(np.linspace(0,len(res_acf)-1,len(res_acf)), res_acf)
+            elif(do_polar==2):
+              ax.set_ylabel('Angle')
+              ax.plot(res_acf, np.linspace(0,359,360))
+              ax.invert_yaxis()
+            else:
+              #peaks, properties = scipy.signal.find_peaks(-res_acf, prominence=None, width=10)
+              #if(len(peaks)):
+                #def f(x, a, b):
+                  #return a + np.exp(b * x)
+                #xdata = np.asarray(range(peaks[0]+1))
+                #ydata = res_acf[0:peaks[0]+1]
+                #popt, pcov = scipy.optimize.curve_fit(f, xdata, ydata, p0=[1,-1], bounds=((-np.inf, -np.inf), (np.inf, 0)), maxfev=10000)
+                #print(popt)
+                #A[ifrm] = popt[1]
+                #ax.plot(xdata, f(xdata, *popt))
+              xdata = np.asarray(range(len(res_acf)))
+              ydata = res_acf
+              #for c in range(1,11):
+              if 1:
+                def f(x, a, b, c):
+                  return a *  np.exp( - b * x ) + (1 - a) * np.exp( - c * x ) #np.power(1 + x, -b)#a * np.exp( -b * x ) + (1 - a) * np.exp( -c * x )
+                popt, pcov = scipy.optimize.curve_fit(f, xdata, ydata, p0=[0.5, 1, 10], bounds=((0, 0, 0), (1, np.inf, np.inf)), maxfev=10000)
+                print(popt)
+                frm_params[ifrm,:] = popt[:]
               
-              frm_residuals[ifrm] = np.linalg.norm(f(xdata, *popt) - ydata)
-              ax.plot(xdata, f(xdata, *popt), label=f'Fit')
+                frm_residuals[ifrm] = np.linalg.norm(f(xdata, *popt) - ydata)
+                ax.plot(xdata, f(xdata, *popt), label=f'Fit')
             
-            #window_size = 10
-            #dcdx = np.diff(res_acf)/res_acf[:-1]
-            #dcdx_avg = np.zeros((len(res_acf)-window_size), dtype=np.float)
-            #for idt in range(len(dcdx_avg)):
-              #dcdx_avg[idt] = np.mean(dcdx[idt:idt+window_size])
+              #window_size = 10
+              #dcdx = np.diff(res_acf)/res_acf[:-1]
+              #dcdx_avg = np.zeros((len(res_acf)-window_size), dtype=np.float)
+              #for idt in range(len(dcdx_avg)):
+                #dcdx_avg[idt] = np.mean(dcdx[idt:idt+window_size])
 
-            #ax.plot(xdata[:len(dcdx_avg)], dcdx_avg, label='Avg dc/dx')
+              #ax.plot(xdata[:len(dcdx_avg)], dcdx_avg, label='Avg dc/dx')
             
-            ax.set_ylim([-0.05, 1])
-            ax.set_xlabel('Radial Distance')
-            ax.plot(np.linspace(0,len(res_acf)-1,len(res_acf)), res_acf, label='Avg ACF')
-            ax.legend()
+              ax.set_ylim([-0.05, 1])
+              ax.set_xlabel('Radial Distance')
+              ax.plot(np.linspace(0,len(res_acf)-1,len(res_acf)), res_acf, label='Avg ACF')
+              ax.legend()
           
-          if(do_polar==0):
-            ax = fig.add_subplot(1, num_panels, 5)
-            ax.set_ylim([1e-3, 1e3])
-            ax.set_yscale('log')
-            ax.set_xlabel('Time')
-            ax.set_title('Decay Exponent (pixels, 1 pixel ~ 1-1.5 um)')
+            if(do_polar==0):
+              ax = fig.add_subplot(1, num_panels, 5)
+              ax.set_ylim([1e-3, 1e3])
+              ax.set_yscale('log')
+              ax.set_xlabel('Time')
+              ax.set_title('Decay Exponent (pixels, 1 pixel ~ 1-1.5 um)')
             
-            #A = frm_params[:,0] - np.sqrt(frm_params[:,0])
-            #B = frm_params[:,0] + np.sqrt(frm_params[:,0])
+              #A = frm_params[:,0] - np.sqrt(frm_params[:,0])
+              #B = frm_params[:,0] + np.sqrt(frm_params[:,0])
             
-            ax.plot(np.asarray(range(len(frames))), frm_params[:,0], label='A')
-            ax.plot(np.asarray(range(len(frames))), frm_params[:,1], label='B')
-            ax.plot(np.asarray(range(len(frames))), frm_params[:,2], label='C')
+              ax.plot(np.asarray(range(len(frames))), frm_params[:,0], label='A')
+              ax.plot(np.asarray(range(len(frames))), frm_params[:,1], label='B')
+              ax.plot(np.asarray(range(len(frames))), frm_params[:,2], label='C')
             
-            ax2 = ax.twinx()
-            ax2.plot(np.asarray(range(len(frames))), frm_residuals, 'r--', label='Residuals')
-            ax2.set_ylabel('Residuals')
+              ax2 = ax.twinx()
+              ax2.plot(np.asarray(range(len(frames))), frm_residuals, 'r--', label='Residuals')
+              ax2.set_ylabel('Residuals')
             
-            #for c in range(10):
-              #ax.plot(np.asarray(range(len(frames))), frm_params[:,c], label=f'fit {c}')
+              #for c in range(10):
+                #ax.plot(np.asarray(range(len(frames))), frm_params[:,c], label=f'fit {c}')
             
-            #ax.plot(np.asarray(range(len(frames))), frm_params[:,2], label='C')
+              #ax.plot(np.asarray(range(len(frames))), frm_params[:,2], label='C')
             
-            #ax.plot(np.asarray(range(len(frames))), -np.log(0.1)/A[:, 0], label='10-fold distance')
-            #ax.plot(np.asarray(range(len(frames))), np.power(0.1, -1.0/A[:, 0])-1, label='10-fold distance')
-            ax.legend()
-
-          #ax.xaxis.set_major_formatter(tck.FormatStrFormatter('%g $\mu m$'))
-          #ax.xaxis.set_major_locator(tck.MultipleLocator(base=40.0))
-          #ax.yaxis.set_major_formatter(tck.FormatStrFormatter('%g $\mu m$'))
-          #ax.yaxis.set_major_locator(tck.MultipleLocator(base=40.0))
-
-          fig.tight_layout()
-          if(do_polar>0):
-            fig.savefig(os.path.join(os.path.dirname(out),f'acf-polar-{ifrm}.png'))
-          else:
-            fig.savefig(os.path.join(os.path.dirname(out),f'acf-cartesian-{ifrm}.png'))
-          plt.close(fig)
-
-        # Get the average radial Power Spectral Density
-        if(do_psd):
-          maxdim = max(img_flt.shape)
-          xi = []
-          if maxdim % 2 == 0:
-            xi = [range(-maxdim//2,0), range(1,maxdim//2+1)]
-          else:
-            xi = range(-maxdim//2,maxdim//2)
-          X, Y = np.meshgrid(xi, xi)
-          rho = np.floor(np.sqrt(X**2 + Y**2))
-          res_psd = np.zeros((maxdim//2),dtype=np.float)
-          for ri in range(maxdim//2):
-            xyi = rho == ri
-            res_psd[ri] = np.abs(np.nanmean(img_c_spect_cmb[xyi]))**2
-          res_psd /= img_total
-
-        # store the data
-        #frm_spect[ifrm,:,:] = np.abs(img_spect[img_flt.shape[0]//2:img_flt.shape[0]//2+img_flt.shape[0],img_flt.shape[1]//2:img_flt.shape[1]//2+img_flt.shape[1]])
-        #frm_acf[ifrm, :, :] = img_acf
-        frm_avg_acf[ifrm, :] = res_acf
-        if(do_psd):
-          frm_psd[ifrm, :] = res_psd
-
-        if((frm % n_frm_write_out)==0):
-          handle.seek(0)
+              #ax.plot(np.asarray(range(len(frames))), -np.log(0.1)/A[:, 0], label='10-fold distance')
+              #ax.plot(np.asarray(range(len(frames))), np.power(0.1, -1.0/A[:, 0])-1, label='10-fold distance')
+              ax.legend()
+
+            #ax.xaxis.set_major_formatter(tck.FormatStrFormatter('%g $\mu m$'))
+            #ax.xaxis.set_major_locator(tck.MultipleLocator(base=40.0))
+            #ax.yaxis.set_major_formatter(tck.FormatStrFormatter('%g $\mu m$'))
+            #ax.yaxis.set_major_locator(tck.MultipleLocator(base=40.0))
+
+            fig.tight_layout()
+            if(do_polar>0):
+              fig.savefig(os.path.join(os.path.dirname(out),f'acf-polar-{ifrm}.png'))
+            else:
+              fig.savefig(os.path.join(os.path.dirname(out),f'acf-cartesian-{ifrm}.png'))
+            plt.close(fig)
+
+          # Get the average radial Power Spectral Density
           if(do_psd):
-            write_out(handle, frm_avg_acf[:ifrm+1,:], frm_psd[:ifrm+1,:])
-          else:
-            write_out(handle, frm_avg_acf[:ifrm+1,:])
-          write_out(handle, frm_img_avg_med[:ifrm+1,:])
-          if debug:
-            write_out(handle, frm_residuals[:ifrm+1])
-          #write_out(handle, frm_spect[:ifrm+1,:,:], frm_acf[:ifrm+1,:,:], frm_avg_acf[:ifrm+1,:], frm_psd[:ifrm+1,:])
+            maxdim = max(img_flt.shape)
+            xi = []
+            if maxdim % 2 == 0:
+              xi = [range(-maxdim//2,0), range(1,maxdim//2+1)]
+            else:
+              xi = range(-maxdim//2,maxdim//2)
+            X, Y = np.meshgrid(xi, xi)
+            rho = np.floor(np.sqrt(X**2 + Y**2))
+            res_psd = np.zeros((maxdim//2),dtype=np.float)
+            for ri in range(maxdim//2):
+              xyi = rho == ri
+              res_psd[ri] = np.abs(np.nanmean(img_c_spect_cmb[xyi]))**2
+            res_psd /= img_total
+
+          # store the data
+          #frm_spect[ifrm,:,:] = np.abs(img_spect[img_flt.shape[0]//2:img_flt.shape[0]//2+img_flt.shape[0],img_flt.shape[1]//2:img_flt.shape[1]//2+img_flt.shape[1]])
+          #frm_acf[ifrm, :, :] = img_acf
+          frm_avg_acf[ifrm, :] = res_acf
+          if(do_psd):
+            frm_psd[ifrm, :] = res_psd
+
+          if((frm % n_frm_write_out)==0):
+            handle.seek(0)
+            if(do_psd):
+              write_out(handle, frm_avg_acf[:ifrm+1,:], frm_psd[:ifrm+1,:])
+            else:
+              write_out(handle, frm_avg_acf[:ifrm+1,:])
+            write_out(handle, frm_img_avg_med[:ifrm+1,:])
+            if debug:
+              write_out(handle, frm_residuals[:ifrm+1])
+            #write_out(handle, frm_spect[:ifrm+1,:,:], frm_acf[:ifrm+1,:,:], frm_avg_acf[:ifrm+1,:], frm_psd[:ifrm+1,:])
 
       if(do_psd):
         write_out(handle, frm_avg_acf[:ifrm+1,:], frm_psd[:ifrm+1,:])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import functools
+
+import numpy as np
+
+###
+# Radial & angular profiles
+###
+
+class ProfileEngine:
+  """
+  NaN-aware mean of an image over bins of pixels (e.g. radius or angle)
+    bins  : bin index of every pixel, negative for the pixels to leave out
+    nbins : number of bins, pixels with a larger index are left out
+
+  The bin index of every pixel is built once per image size, every profile is
+  then one or two weighted np.bincount calls. Empty bins are NaN, as with
+  np.nanmean.
+  """
+  def __init__(self, bins, nbins):
+    bins = np.asarray(bins).ravel()
+    self._nbins = nbins
+    self._pixels = np.nonzero((bins >= 0) & (bins < nbins))[0]
+    self._bins = bins[self._pixels]
+    self._counts = np.bincount(self._bins, minlength=nbins).astype(np.float64)
+
+  @classmethod
+  def cartesian(cls, shape, nbins):
+    """Bins of the integer distance floor(sqrt(i^2 + j^2)) to pixel (0, 0)"""
+    rows, cols = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
+    return cls(np.floor(np.sqrt(rows**2 + cols**2)).astype(np.int64), nbins)
+
+  @classmethod
+  def periodic(cls, shape, nbins):
+    """Bins of the integer minimum-image distance to pixel (0, 0) of a periodic image"""
+    rows, cols = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
+    rows = np.minimum(rows, shape[0] - rows)
+    cols = np.minimum(cols, shape[1] - cols)
+    return cls(np.floor(np.sqrt(rows**2 + cols**2)).astype(np.int64), nbins)
+
+  @classmethod
+  def radial(cls, shape, nbins, angles=360):
+    """Bins of the columns (radius) of a polar image, over its first rows (angles)"""
+    rows, cols = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
+    return cls(np.where(rows < angles, cols, -1), nbins)
+
+  @classmethod
+  def angular(cls, shape, nbins=360):
+    """Bins of the rows (angle) of a polar image"""
+    rows, cols = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
+    return cls(rows, nbins)
+
+  def __call__(self, img, out=None):
+    """
+    Profile of an image
+      img : image of the size the engine was built for
+      out : array of nbins values to write the profile into
+    """
+    vals = np.ravel(img)[self._pixels].astype(np.float64, copy=False)
+    nan = np.isnan(vals)
+    if(nan.any()):
+      sums = np.bincount(self._bins, weights=np.where(nan, 0.0, vals), minlength=self._nbins)
+      counts = np.bincount(self._bins, weights=~nan, minlength=self._nbins)
+    else:
+      sums = np.bincount(self._bins, weights=vals, minlength=self._nbins)
+      counts = self._counts
+    if(out is None):
+      out = np.empty(self._nbins, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      np.divide(sums, counts, out=out)
+    out[counts == 0] = np.nan
+    return out
+
+@functools.lru_cache(maxsize=16)
+def profile_engine(mode, shape, nbins):
+  """
+  Shared profile engine for an image size
+    mode  : 'cartesian', 'periodic', 'radial' or 'angular'
+    shape : image shape (tuple)
+    nbins : number of bins
+  """
+  return getattr(ProfileEngine, mode)(shape, nbins)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+###
+# Frame statistics
+###
+
+# columns of the statistics of a frame
+columns = ('mean', 'median', 'std', 'kurtosis', 'sumsq', 'count')
+column = { name : idx for idx, name in enumerate(columns) }
+
+def histogram_stats(counts, values, out=None):
+  """
+  Statistics of the pixels of a frame from their histogram
+    counts : number of pixels of every value
+    values : pixel value of every bin, in increasing order
+    out    : array of len(columns) values to write the statistics into
+  """
+  if(out is None):
+    out = np.empty(len(columns), dtype=np.float64)
+  counts = np.asarray(counts, dtype=np.float64)
+  values = np.asarray(values, dtype=np.float64)
+  n = np.sum(counts)
+  if(n == 0):
+    return _empty(out)
+  mean = np.dot(counts, values) / n
+  d2 = (values - mean)**2
+  m2 = np.dot(counts, d2)
+  m4 = np.dot(counts, d2*d2)
+  # median as np.median: middle value, or the mean of the two middle values
+  cumul = np.cumsum(counts)
+  lower = values[np.searchsorted(cumul, (n - 1)//2, side='right')]
+  upper = values[np.searchsorted(cumul, n//2, side='right')]
+  return _store(out, n, mean, 0.5*(lower + upper), m2, m4)
+
+def moment_stats(img, out=None):
+  """
+  NaN-aware statistics of the pixels of a frame
+    img : image, NaN for the pixels to leave out
+    out : array of len(columns) values to write the statistics into
+
+  Several passes over the valid pixels, in float64: np.add.reduce (pairwise
+  summation) of the pixels, then of the squared and of the fourth powers of
+  the centered pixels, computed in place. The median is the one of
+  np.nanmedian, taken on the valid pixels.
+  """
+  if(out is None):
+    out = np.empty(len(columns), dtype=np.float64)
+  valid = np.ravel(img)
+  valid = valid[~np.isnan(valid)]
+  n = valid.size
+  if(n == 0):
+    return _empty(out)
+  d = valid.astype(np.float64)
+  mean = np.add.reduce(d) / n
+  d -= mean
+  np.multiply(d, d, out=d)
+  m2 = np.add.reduce(d)
+  np.multiply(d, d, out=d)
+  m4 = np.add.reduce(d)
+  return _store(out, n, mean, np.median(valid), m2, m4)
+
+def frame_stats(img, page=None, binary=False, out=None):
+  """
+  Statistics of the pixels of a frame (see columns)
+    img    : image as processed (float, NaN for the pixels to leave out)
+    page   : image as stored in the TIFF file, 8-bit pages are reduced with a
+             256-bin histogram
+    binary : the image is (page > 0)
+    out    : array of len(columns) values to write the statistics into
+
+  The statistics are those of img: mean, median, standard deviation, excess
+  kurtosis, sum of the squared deviations from the mean and number of pixels.
+  """
+  if(page is not None)and(binary):
+    counts = np.bincount(np.ravel(page > 0), minlength=2)
+    return histogram_stats(counts, [0.0, 1.0], out)
+  if(page is not None)and(page.dtype == np.uint8):
+    counts = np.bincount(np.ravel(page), minlength=256)
+    # zeros are NaN in img
+    counts[0] = 0
+    # the float32 values of img (skimage.util.img_as_float32)
+    return histogram_stats(counts, np.arange(256, dtype=np.float32) / np.float32(255), out)
+  return moment_stats(img, out)
+
+def _store(out, n, mean, median, m2, m4):
+  out[column['mean']] = mean
+  out[column['median']] = median
+  out[column['std']] = np.sqrt(m2 / n)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    out[column['kurtosis']] = n * m4 / (m2*m2) - 3.0
+  out[column['sumsq']] = m2
+  out[column['count']] = n
+  return out
+
+def _empty(out):
+  out.fill(np.nan)
+  out[column['sumsq']] = 0.0
+  out[column['count']] = 0
+  return out
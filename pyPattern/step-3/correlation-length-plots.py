@@ -29,6 +29,10 @@ plt.style.use('dark_background')
 
 import clfmodels
 
+# report result files (see pyCytosim/framestore.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'pyCytosim'))
+import framestore
+
 def read_in(handle, *args):
   vals = list()
   for v in args:
@@ -39,6 +43,61 @@ def write_out(handle, *args):
   for v in args:
     pickle.dump(v, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
+# columnar report results (see pyCytosim/framestore.py)
+def is_columnar(data):
+  return isinstance(data, dict) and (data.get('format', None) == 'columnar')
+
+# per-frame summaries of the report results (see pyCytosim/summary.py)
+def is_summary(data):
+  return isinstance(data, dict) and (data.get('format', None) == 'summary')
+
+def summary_path(filepath):
+  if(filepath.endswith('.summary.pickle')):
+    return filepath
+  if(filepath.endswith('.pickle')):
+    filepath = filepath[:-len('.pickle')]
+  return filepath + '.summary.pickle'
+
+def summary_series(filepath):
+  with open(filepath, 'rb') as handle:
+    # simulation directory, then the summary
+    pickle.load(handle)
+    data = pickle.load(handle)
+  return data['series'].keys() if is_summary(data) else []
+
+def open_report(filepath, series=()):
+  """
+  Open the summary of a report result file if there is one with the given
+  series, the result file otherwise
+  """
+  spath = summary_path(filepath)
+  if(os.path.isfile(spath))and(all(name in summary_series(spath) for name in series)):
+    filepath = spath
+  click.echo(f'reading "{filepath}"')
+  return open(filepath, 'rb')
+
+def report_frames(data):
+  if(is_columnar(data))or(is_summary(data)):
+    return data['frames']
+  return list(data.keys())
+
+def read_report(handle):
+  sd = pickle.load(handle)
+  data = pickle.load(handle)
+  if(framestore.is_stream(data)):
+    # one (frame, columns) record per frame, the last one may be truncated
+    builder = framestore.FrameTableBuilder(data['op'], data['ragged'])
+    for frm, cols in framestore.iter_stream(handle, data):
+      builder.append(frm, cols)
+    data = builder.build().state()
+  return sd, data
+
+def mean_per_frame(data, values):
+  counts = np.diff(data['offsets'])
+  sums = np.bincount(np.repeat(np.arange(len(counts)), counts), weights=values, minlength=len(counts))
+  with np.errstate(invalid='ignore', divide='ignore'):
+    return np.where(counts > 0, sums / counts, np.nan)
+
 @click.command()
 @click.option("--data", required=True, multiple=True, type=(str, str), help="Path to file with fit data.")
 @click.option("--out", required=True, type=str, help="Output file name")
@@ -169,24 +228,31 @@ def main(data : str, out : str, avgplot : bool=False, simulation : bool=False, r
     sd=None
     frm_clusters = list()
     for f in clus:
-      with open(f, 'rb') as handle:
+      with open_report(f) as handle:
         click.echo(f'opened cluster data file "{f}"')
-        sd, clusters = read_in(handle, sd, frm_clusters)
+        sd, clusters = read_report(handle)
 
         # average aster size
-        avg_cluster_size = np.zeros([int(len(clusters)/10) + 1])
+        avg_cluster_size = np.zeros([int(len(report_frames(clusters))/10) + 1])
         avg_cluster_size.fill(np.nan)
-        j = 0
-        for i, k in enumerate(clusters.keys()):
-          if((i % 10)!=0):
-            continue
-          c = clusters[k]
-          cluster_size = []
-          for idx, fibers in c.items():
-            cluster_size.append(len(fibers))
-          if(len(cluster_size)):
-            avg_cluster_size[j] = np.nanmean(cluster_size)
-          j+=1
+        if(is_summary(clusters)):
+          cluster_size = clusters['series']['cluster_size_mean'][::10]
+          avg_cluster_size[:len(cluster_size)] = cluster_size
+        elif(is_columnar(clusters)):
+          cluster_size = mean_per_frame(clusters, clusters['columns']['size'])[::10]
+          avg_cluster_size[:len(cluster_size)] = cluster_size
+        else:
+          j = 0
+          for i, k in enumerate(clusters.keys()):
+            if((i % 10)!=0):
+              continue
+            c = clusters[k]
+            cluster_size = []
+            for idx, fibers in c.items():
+              cluster_size.append(len(fibers))
+            if(len(cluster_size)):
+              avg_cluster_size[j] = np.nanmean(cluster_size)
+            j+=1
 
         frm_clusters.append(avg_cluster_size)
 
@@ -195,25 +261,40 @@ def main(data : str, out : str, avgplot : bool=False, simulation : bool=False, r
     frm_fiber_length = list()
     frm_fiber_count = list()
     for f in fiber:
-      with open(f, 'rb') as handle:
+      # the legacy and the columnar results are plotted for the first fiber class
+      with open_report(f, ['fiber_class_length_mean', 'fiber_class_count']) as handle:
         click.echo(f'opened fiber data file "{f}"')
-        sd, fiber_length = read_in(handle, sd, sd)
+        sd, fiber_length = read_report(handle)
 
         # average aster size
-        avg_fiber_length = np.zeros([int(len(fiber_length)/10) + 1])
+        avg_fiber_length = np.zeros([int(len(report_frames(fiber_length))/10) + 1])
         avg_fiber_length.fill(np.nan)
-        avg_fiber_count = np.zeros([int(len(fiber_length)/10) + 1])
+        avg_fiber_count = np.zeros([int(len(report_frames(fiber_length))/10) + 1])
         avg_fiber_count.fill(np.nan)
-        j = 0
-        for i, k in enumerate(fiber_length.keys()):
-          if((i % 10)!=0):
-            continue
-          l = fiber_length[k]
-          if(l['avg'][0] > 0.0):
-            avg_fiber_length[j] = l['avg'][0]
-          if(l['count'][0] > 0.0):
-            avg_fiber_count[j] = l['count'][0]
-          j += 1
+        if(is_summary(fiber_length)):
+          # first fiber class, as below
+          for avg, name in [(avg_fiber_length, 'fiber_class_length_mean'), (avg_fiber_count, 'fiber_class_count')]:
+            l = np.asarray(fiber_length['series'][name][::10, 0], dtype=np.float64)
+            avg[:len(l)] = np.where(l > 0.0, l, np.nan)
+        elif(is_columnar(fiber_length)):
+          # first fiber class of every 10th frame
+          first = fiber_length['offsets'][:-1][::10]
+          valid = np.diff(fiber_length['offsets'])[::10] > 0
+          for avg, name in [(avg_fiber_length, 'avg'), (avg_fiber_count, 'count')]:
+            l = np.full(len(first), np.nan)
+            l[valid] = fiber_length['columns'][name][first[valid]]
+            avg[:len(l)] = np.where(l > 0.0, l, np.nan)
+        else:
+          j = 0
+          for i, k in enumerate(fiber_length.keys()):
+            if((i % 10)!=0):
+              continue
+            l = fiber_length[k]
+            if(l['avg'][0] > 0.0):
+              avg_fiber_length[j] = l['avg'][0]
+            if(l['count'][0] > 0.0):
+              avg_fiber_count[j] = l['count'][0]
+            j += 1
 
         frm_fiber_length.append(avg_fiber_length)
         frm_fiber_count.append(avg_fiber_count)